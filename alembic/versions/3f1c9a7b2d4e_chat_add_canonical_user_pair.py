@@ -0,0 +1,66 @@
+"""Chat: add canonical user pair with unique index
+
+Revision ID: 3f1c9a7b2d4e
+Revises: e9f34b36461d
+Create Date: 2026-10-18 12:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f1c9a7b2d4e'
+down_revision: Union[str, None] = 'e9f34b36461d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('chat', sa.Column('user_low_id', sa.Integer(), nullable=True))
+    op.add_column('chat', sa.Column('user_high_id', sa.Integer(), nullable=True))
+    op.create_foreign_key('chat_user_low_id_fkey', 'chat', 'users', ['user_low_id'], ['id'], ondelete='CASCADE')
+    op.create_foreign_key('chat_user_high_id_fkey', 'chat', 'users', ['user_high_id'], ['id'], ondelete='CASCADE')
+
+    op.execute("""
+        UPDATE chat
+        SET user_low_id = LEAST(sender_id, receiver_id),
+            user_high_id = GREATEST(sender_id, receiver_id)
+    """)
+
+    # Concurrent first messages could create several chats for one pair,
+    # keep the oldest one and move the messages of the others into it
+    op.execute("""
+        CREATE TEMPORARY TABLE chat_duplicate ON COMMIT DROP AS
+        SELECT id, MIN(id) OVER (PARTITION BY user_low_id, user_high_id) AS keep_id
+        FROM chat
+        WHERE user_low_id IS NOT NULL
+    """)
+    op.execute("""
+        UPDATE message SET chat_id = d.keep_id
+        FROM chat_duplicate d
+        WHERE message.chat_id = d.id AND d.id <> d.keep_id
+    """)
+    op.execute("""
+        INSERT INTO chat_users (chat_id, user_id)
+        SELECT DISTINCT d.keep_id, cu.user_id
+        FROM chat_users cu JOIN chat_duplicate d ON cu.chat_id = d.id
+        WHERE d.id <> d.keep_id
+        ON CONFLICT DO NOTHING
+    """)
+    op.execute("""
+        DELETE FROM chat USING chat_duplicate d
+        WHERE chat.id = d.id AND d.id <> d.keep_id
+    """)
+
+    op.create_index('ix_chat_user_pair', 'chat', ['user_low_id', 'user_high_id'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_chat_user_pair', table_name='chat')
+    op.drop_constraint('chat_user_high_id_fkey', 'chat', type_='foreignkey')
+    op.drop_constraint('chat_user_low_id_fkey', 'chat', type_='foreignkey')
+    op.drop_column('chat', 'user_high_id')
+    op.drop_column('chat', 'user_low_id')
@@ -0,0 +1,36 @@
+"""fanout_payload: backplane envelopes too large for NOTIFY
+
+Revision ID: 5a7c9e1b3d2f
+Revises: e4a8b2c6d0f1
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5a7c9e1b3d2f'
+down_revision: Union[str, None] = 'e4a8b2c6d0f1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Rows live a minute, they need no WAL nor to survive a crash
+    op.create_table(
+        'fanout_payload',
+        sa.Column('id', sa.BigInteger(), nullable=False),
+        sa.Column('payload', sa.Text(), nullable=False),
+        sa.Column('created_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('NOW()'), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        prefixes=['UNLOGGED'],
+    )
+    op.create_index('ix_fanout_payload_created_at', 'fanout_payload', ['created_at'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_fanout_payload_created_at', table_name='fanout_payload')
+    op.drop_table('fanout_payload')
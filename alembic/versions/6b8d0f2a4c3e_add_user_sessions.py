@@ -0,0 +1,37 @@
+"""user_sessions: refresh-token sessions out of the users table
+
+Revision ID: 6b8d0f2a4c3e
+Revises: 5a7c9e1b3d2f
+Create Date: 2026-10-19 11:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6b8d0f2a4c3e'
+down_revision: Union[str, None] = '5a7c9e1b3d2f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'user_sessions',
+        sa.Column('id', sa.String(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('expires_at', sa.TIMESTAMP(timezone=True), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index(op.f('ix_user_sessions_user_id'), 'user_sessions', ['user_id'])
+    op.create_index(op.f('ix_user_sessions_expires_at'), 'user_sessions', ['expires_at'])
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_user_sessions_expires_at'), table_name='user_sessions')
+    op.drop_index(op.f('ix_user_sessions_user_id'), table_name='user_sessions')
+    op.drop_table('user_sessions')
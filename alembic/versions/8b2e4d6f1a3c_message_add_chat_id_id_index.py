@@ -0,0 +1,26 @@
+"""Message: add (chat_id, id DESC) index for history pagination
+
+Revision ID: 8b2e4d6f1a3c
+Revises: 3f1c9a7b2d4e
+Create Date: 2026-10-18 12:40:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8b2e4d6f1a3c'
+down_revision: Union[str, None] = '3f1c9a7b2d4e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_message_chat_id_id', 'message', ['chat_id', sa.text('id DESC')], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_message_chat_id_id', table_name='message')
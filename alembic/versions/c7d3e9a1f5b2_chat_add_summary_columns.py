@@ -0,0 +1,55 @@
+"""Chat: add last message summary and per-participant unread counters
+
+Revision ID: c7d3e9a1f5b2
+Revises: 8b2e4d6f1a3c
+Create Date: 2026-10-18 12:50:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c7d3e9a1f5b2'
+down_revision: Union[str, None] = '8b2e4d6f1a3c'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('chat', sa.Column('last_message_id', sa.Integer(), nullable=True))
+    op.add_column('chat', sa.Column('last_message_at', sa.TIMESTAMP(timezone=True), nullable=True))
+    op.add_column('chat_users', sa.Column('unread_count', sa.Integer(), server_default=sa.text('0'), nullable=False))
+    op.create_index('ix_chat_users_user_id', 'chat_users', ['user_id'], unique=False)
+
+    op.execute("""
+        UPDATE chat
+        SET last_message_id = m.id, last_message_at = m.created_at
+        FROM (
+            SELECT DISTINCT ON (chat_id) chat_id, id, created_at
+            FROM message
+            ORDER BY chat_id, id DESC
+        ) m
+        WHERE chat.id = m.chat_id
+    """)
+    op.execute("""
+        UPDATE chat_users
+        SET unread_count = m.count
+        FROM (
+            SELECT cu.chat_id, cu.user_id, count(*) AS count
+            FROM chat_users cu
+            JOIN message ON message.chat_id = cu.chat_id AND message.user_id <> cu.user_id
+            WHERE message.read IS false
+            GROUP BY cu.chat_id, cu.user_id
+        ) m
+        WHERE chat_users.chat_id = m.chat_id AND chat_users.user_id = m.user_id
+    """)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_chat_users_user_id', table_name='chat_users')
+    op.drop_column('chat_users', 'unread_count')
+    op.drop_column('chat', 'last_message_at')
+    op.drop_column('chat', 'last_message_id')
@@ -0,0 +1,41 @@
+"""chat_users: add last_read_message_id read watermark
+
+Revision ID: e4a8b2c6d0f1
+Revises: c7d3e9a1f5b2
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4a8b2c6d0f1'
+down_revision: Union[str, None] = 'c7d3e9a1f5b2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('chat_users', sa.Column('last_read_message_id', sa.Integer(), nullable=True))
+
+    # Read up to the first unread message of the other side, or everything
+    op.execute("""
+        UPDATE chat_users
+        SET last_read_message_id = COALESCE(
+            (
+                SELECT MIN(message.id) - 1
+                FROM message
+                WHERE message.chat_id = chat_users.chat_id
+                  AND message.user_id <> chat_users.user_id
+                  AND message.read IS false
+            ),
+            (SELECT chat.last_message_id FROM chat WHERE chat.id = chat_users.chat_id)
+        )
+    """)
+
+
+def downgrade() -> None:
+    op.drop_column('chat_users', 'last_read_message_id')
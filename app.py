@@ -1,24 +1,25 @@
-from datetime import datetime
-import json
-import redis
+from contextlib import asynccontextmanager
+import logging
 import os
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request, Depends
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request
+from fastapi.responses import HTMLResponse, ORJSONResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
 
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.future import select
-from sqlalchemy.orm import selectinload
-from sqlalchemy import func
-
 from schemas.users import UserBase
 from security.security import get_current_user, get_token_payload
-from models.users import Chat, Message, chat_users
+from security.hashing import password_hasher
+from security.sessions import session_store
 from orm.orm import OrmService
-from routers import auth, users, chat
-from db.db import get_db
+from routers import auth, users, chat, system
+from db.db import async_session, pool_stats
+from metrics.metrics import METRICS_ENABLED, HTTPMetricsMiddleware, metrics_endpoint, register_stats
+from orm.writer import MessageWriter
+from ws.manager import manager
+from ws.receipts import receipts
+from ws.frames import decode_frame, encode_frame
+from logging_.logging__ import setup_logging
 
 
 ########## SECRETE KEY LOGIC ##########
@@ -26,7 +27,32 @@ from db.db import get_db
 # print(f"SECRET_KEY = '{secret_key}'")
 #######################################
 
-app = FastAPI()
+log_listener = setup_logging()
+logger = logging.getLogger(__name__)
+# One record per received frame, sampled through LOG_SAMPLE
+frame_logger = logging.getLogger("app.frames")
+
+# Optional group-commit of messages, see MessageWriter.from_env
+message_writer = MessageWriter.from_env(async_session)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await manager.start()
+    if message_writer is not None:
+        await message_writer.start()
+    yield
+    if message_writer is not None:
+        await message_writer.stop()
+    await receipts.stop()
+    await manager.stop()
+    password_hasher.shutdown()
+    await session_store.close()
+    log_listener.stop()
+
+
+# orjson renders every JSON response, several times faster than the json module
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 origins = [
     "http://localhost:8081",  # React app running locally
@@ -46,71 +72,97 @@ templates = Jinja2Templates(directory="templates")
 app.include_router(auth.router)
 app.include_router(users.router)
 app.include_router(chat.router)
+app.include_router(system.router)
+
+if METRICS_ENABLED:
+    app.add_middleware(HTTPMetricsMiddleware)
+    app.add_route("/metrics", metrics_endpoint, include_in_schema=False)
+    register_stats("chat_db_pool", pool_stats, counters=("checkouts", "timeouts"))
+    register_stats(
+        "chat_ws",
+        manager.queue_stats,
+        counters=("dropped", "coalesced", "batched", "evicted", "received", "delivered", "fanout_frames", "fanout_sockets"),
+    )
+    register_stats("chat_bcrypt", password_hasher.stats, counters=("completed", "rejected"))
+    if message_writer is not None:
+        register_stats(
+            "chat_message_writer",
+            lambda: {"batches": message_writer.batches, "written": message_writer.written},
+            counters=("batches", "written"),
+        )
+
 
 
-# REDIS_HOST = os.getenv("REDIS_HOST")
-# REDIS_PORT = os.getenv("REDIS_PORT")
 
-# redis_client = redis.Redis(host=REDIS_HOST, port=int(REDIS_PORT), decode_responses=True)
+@app.get('/', response_class=HTMLResponse)
+async def index(request: Request):
+    return templates.TemplateResponse('chat.html', {"request": request})
 
-# @app.post("/set/")
-# async def set_value(key: str, value: str):
-#     redis_client.set(key, value)
-#     return {"message": f"Stored {key} = {value}"}
 
-# @app.get("/get/")
-# async def get_value(key: str):
-#     value = redis_client.get(key)
-#     return {"key": key, "value": value}
 
+async def send_chat_message(sender_id: int, receiver_id: int, message: str):
+    """Save a 1:1 message and deliver it to the participants of the chat"""
 
-class ConnectionManager:
-    def __init__(self):
-        # Ensure this is a dictionary, not a list
-        self.active_connections: dict[int, WebSocket] = {}
+    # Online receiver gets the message right away, so it is read
+    is_active = await manager.is_user_online(receiver_id)
 
-    async def connect(self, websocket: WebSocket, chat_id: int):
-        await websocket.accept()
-        self.active_connections[chat_id] = websocket
-        # self.active_connections[user_id] = websocket
-        print('************* WEBSOCCET IS CONNECTED ***************')
+    # A session per message: idle sockets hold no pool connection
+    async with async_session() as db:
+        __orm = OrmService(db)
+        new_message = await __orm.send_message(
+            sender_id, receiver_id, message, read=is_active, writer=message_writer
+        )
+        participants = await __orm.chat_participants(new_message.chat_id)
 
-    def disconnect(self, websocket: WebSocket):
-        # pass
-        user_id = next((uid for uid, ws in self.active_connections.items() if ws == websocket), None)
-        if user_id:
-            del self.active_connections[user_id]
+    message_data = new_message_frame(new_message, sender_id, receiver_id, message, is_active)
+    await manager.send_to_users(participants, encode_frame(message_data))
 
 
-    async def is_user_online(self, user_id: str) -> bool:
-        return user_id in self.active_connections
+# Messages stored per transaction when a client sends an array of them
+WS_MAX_BATCH = int(os.getenv("WS_MAX_BATCH", 100))
 
-    async def send_personal_message(self, message: str, websocket: WebSocket):
-        if message.startswith == 'chat_onopen':
-            await websocket.send_text(message)
-        if message.startswith == 'chat_onclose':
-            await websocket.send_text(message)
-        else:
-            # await websocket.send_text(message)
-            try:
-                await websocket.send_text(message)
-            except RuntimeError:
-                print("WebSocket closed, cannot send message.")
 
-    """Here is the proble: when the user close the chat, I've got a disconnect error even if it connected again. Solve it"""
-    async def broadcast(self, message: str):
-        for connection in self.active_connections.values():
-            await connection.send_text(message)
+async def send_chat_messages(items: list[dict]):
+    """
+    Save a batch of 1:1 messages from one client frame and deliver each of them.
 
-    def get_connection(self, user_id: int) -> WebSocket | None:
-        return self.active_connections.get(user_id)
+    The whole batch is stored in one transaction (WS_MAX_BATCH messages at
+    most, longer arrays take several), then every message goes to the
+    participants of its chat like a single one would.
+    """
+    for start in range(0, len(items), WS_MAX_BATCH):
+        batch = [
+            {"sender_id": item["sender_id"], "receiver_id": item["receiver_id"], "message": item["message"]}
+            for item in items[start:start + WS_MAX_BATCH]
+        ]
+        online = {}
+        for item in batch:
+            if item["receiver_id"] not in online:
+                online[item["receiver_id"]] = await manager.is_user_online(item["receiver_id"])
+            item["read"] = online[item["receiver_id"]]
 
-manager = ConnectionManager()
+        async with async_session() as db:
+            __orm = OrmService(db)
+            rows = await __orm.send_messages(batch)
+            participants = {row.chat_id: await __orm.chat_participants(row.chat_id) for row in rows}
 
+        for item, row in zip(batch, rows):
+            message_data = new_message_frame(row, item["sender_id"], item["receiver_id"], item["message"], item["read"])
+            await manager.send_to_users(participants[row.chat_id], encode_frame(message_data))
 
-@app.get('/', response_class=HTMLResponse)
-async def index(request: Request):
-    return templates.TemplateResponse('chat.html', {"request": request})
+
+def new_message_frame(new_message, sender_id: int, receiver_id: int, message: str, is_active: bool) -> dict:
+    return {
+        "info": "new_message",
+        "id": new_message.id,
+        "message": message,
+        "chat_id": new_message.chat_id,
+        "user_id": sender_id,
+        "read": is_active,
+        "created_at": new_message.created_at.isoformat(),  # Convert datetime to string
+        "receiver_id": receiver_id,
+        "is_active": is_active,
+    }
 
 
 
@@ -119,120 +171,46 @@ async def websocket_endpoint(
     websocket: WebSocket,
     sender_id: int, 
     token: str,
-    db: AsyncSession = Depends(get_db)
     ):
 
     user = await get_token_payload(token)
 
     if user['id'] == sender_id:
-        await manager.connect(websocket, user['id'])
+        # ?batch=1: the client takes several events in one frame, as a JSON array
+        await manager.connect(websocket, user['id'], batch=websocket.query_params.get("batch") == "1")
         message_data = {
                 "is active": user['id'],
                 "sender_id": sender_id, 
                 "message": f"{user['id']} is active",
              }
-        await manager.broadcast(json.dumps(message_data))
+        await manager.broadcast(encode_frame(message_data), key=f"presence:{user['id']}")
         while True:
             try:
-                data = await websocket.receive_json()
-                print('SENDED DATA:', data, "Type:", type(data))
+                data = decode_frame(await websocket.receive_text())
+                manager.received += 1
+
+                # [{"sender_id": ..., "receiver_id": ..., "message": ...}, ...]
+                if isinstance(data, list):
+                    if frame_logger.isEnabledFor(logging.DEBUG):
+                        frame_logger.debug("Batch received", extra={"user_id": user['id'], "messages": len(data)})
+                    await send_chat_messages(data)
+                    continue
+
+                # At INFO and above the extra is not even built
+                if frame_logger.isEnabledFor(logging.DEBUG):
+                    frame_logger.debug("Frame received", extra={"user_id": user['id'], "keys": sorted(data)})
+
+                # {"type": "read", "chat_id": ..., "message_id": ...}
+                if data.get("type") == "read":
+                    async with async_session() as db:
+                        await chat.mark_chat_read(db, data["chat_id"], user['id'], data["message_id"])
+                    continue
 
                 sender_id = data["sender_id"]
                 receiver_id = data["receiver_id"]
                 message = data["message"]
 
-
-                """Check if user is online to mark message as read"""
-
-                is_active = await manager.is_user_online(receiver_id)
-
-
-                """Check if chat exists"""
-
-                result = await db.execute(
-                                select(Chat)
-                                .join(chat_users)
-                                .filter(chat_users.c.user_id.in_([sender_id, receiver_id]))
-                                .group_by(Chat.id)
-                                .having(func.count(chat_users.c.user_id) == 2)  # Ensure both users exist in the same chat
-                                .options(selectinload(Chat.messages))
-                            )
-                obj = result.scalars().first()
-
-                
-                """Create new chat if it doesn't exist"""
-
-                if obj is None:
-                    chat_form = {
-                        "sender_id": sender_id,
-                        "receiver_id": receiver_id,
-                        "messages": [Message(message=message, read=is_active)]
-                    }
-                    __orm = OrmService(db)
-                    new_chat = await __orm.create(model=Chat, form=chat_form)
-                    await db.execute(
-                        chat_users.insert().values([
-                            {"chat_id": new_chat.id, "user_id": sender_id},
-                            {"chat_id": new_chat.id, "user_id": receiver_id}
-                        ])
-                    )
-                    await db.commit()
-
-                    obj = new_chat
-
-                    new_message = Message(
-                        message=message, 
-                        chat_id=obj.id,
-                        user_id=sender_id,
-                        read=is_active,
-                        created_at=datetime.utcnow()
-                        )
-                    db.add(new_message)
-                    await db.commit()
-                    await db.refresh(new_message)
-
-                    message_data = {
-                        "info": "new_message",
-                        "id": new_message.id,
-                        "message": new_message.message,
-                        "chat_id": new_message.chat_id,
-                        "user_id": new_message.user_id,
-                        "read": new_message.read,
-                        "created_at": new_message.created_at.isoformat(),  # Convert datetime to string
-                        "receiver_id": receiver_id,
-                        "is_active": is_active,
-                    }
-                    await manager.broadcast(json.dumps(message_data))
-                    # await main_manager.broadcast(json.dumps(message_data))
-
-                else:
-
-                    """ If chat exists - add new message """
-
-                    new_message = Message(
-                        message=message, 
-                        chat_id=obj.id,
-                        user_id=sender_id,
-                        read=is_active,
-                        created_at=datetime.utcnow()
-                        )
-                    db.add(new_message)
-                    await db.commit()
-                    await db.refresh(new_message)
-
-                    message_data = {
-                        "info": "new_message",
-                        "id": new_message.id,
-                        "message": new_message.message,
-                        "chat_id": new_message.chat_id,
-                        "user_id": new_message.user_id,
-                        "read": new_message.read,
-                        "created_at": new_message.created_at.isoformat(),  # Convert datetime to string
-                        "receiver_id": receiver_id,
-                        "is_active": is_active,
-                    }
-                    await manager.broadcast(json.dumps(message_data))
-                    # await main_manager.broadcast(json.dumps(message_data))
+                await send_chat_message(sender_id, receiver_id, message)
                 
             # except WebSocketDisconnect:
             #     print(f"WebSocket client_id {client_id} disconnected.")
@@ -245,8 +223,13 @@ async def websocket_endpoint(
             #     manager.disconnect(websocket)
             #     break
             except Exception as e:
-                print(f"Error in WebSocket: {e}")
-                await manager.broadcast("401 Unauthorized")
+                await manager.disconnect(websocket)
+                if isinstance(e, WebSocketDisconnect):
+                    logger.info("Websocket closed", extra={"user_id": user['id'], "code": e.code})
+                else:
+                    logger.warning("Error in websocket: %r", e, extra={"user_id": user['id']})
+                    # Only the failing socket is told, a closing socket is not a global event
+                    await manager.send_personal_message("401 Unauthorized", websocket)
                 await websocket.close()
                 break
 
@@ -258,156 +241,92 @@ async def websocket_endpoint(
     sender_id: int, 
     client_id: int,
     token: str,
-    db: AsyncSession = Depends(get_db)
 ):
 
     # Validate token and authenticate user
     if token:
-        current_user = await get_current_user(token, db)
+        async with async_session() as db:
+            current_user = await get_current_user(token, db)
 
         if current_user:
-            print(' *********** WEBSOCKET INDEX CURRENT USER ID *********** ', current_user.id)
-            await manager.connect(websocket, current_user.id)
+            logger.info("Websocket connected", extra={"user_id": current_user.id})
+            await manager.connect(websocket, current_user.id, batch=websocket.query_params.get("batch") == "1")
             message_data = {
                     "is active": current_user.id,
                     "sender_id": sender_id, 
                     "client_id": client_id,
                 }
-            await manager.broadcast(json.dumps(message_data))
+            await manager.broadcast(encode_frame(message_data), key=f"presence:{current_user.id}")
             # is_active = await manager.is_user_online(data['receiver_id'])
 
             try:
                 while True:
 
                     try:
-                        data = await websocket.receive_json()
-                        print('SENDED DATA:', data, "Type:", type(data))
+                        data = decode_frame(await websocket.receive_text())
+                        manager.received += 1
+
+                        if isinstance(data, list):
+                            if frame_logger.isEnabledFor(logging.DEBUG):
+                                frame_logger.debug("Batch received", extra={"user_id": current_user.id, "messages": len(data)})
+                            await send_chat_messages(data)
+                            continue
+
+                        if frame_logger.isEnabledFor(logging.DEBUG):
+                            frame_logger.debug("Frame received", extra={"user_id": current_user.id, "keys": sorted(data)})
+
+                        if data.get("type") == "read":
+                            async with async_session() as db:
+                                await chat.mark_chat_read(
+                                    db, data["chat_id"], current_user.id, data["message_id"]
+                                )
 
-                            # Broadcast "chat_onopen" message
-                        if data["message"] == "chat_onopen":
-                            await manager.broadcast(f"chat_onopen {data['sender_id']} is active")
+                            # "chat_onopen" goes to both sides of the chat only
+                        elif data["message"] == "chat_onopen":
+                            await manager.send_to_users(
+                                [current_user.id, data['receiver_id']], f"chat_onopen {data['sender_id']} is active"
+                            )
                             is_active = await manager.is_user_online(data['receiver_id'])
-                            print(' ################ chat_onopen is_active ################ ', is_active)
+                            logger.debug("Chat opened", extra={"user_id": current_user.id, "receiver_active": is_active})
 
                         elif data["message"] == "receiver_active":
                             # print(' ################ receiver_active ################ ', data)
-                            await manager.broadcast(f"is_active")
+                            await manager.send_to_users([current_user.id, data['receiver_id']], "is_active")
 
                         # If use 'else' - will be send a message 'chat_onopen' or 'chat_onclose'
                         # But if use 'elif...' will be send only real user's message
                         elif data["message"] != "chat_onopen" and data["message"] != "chat_onclose":
-                            sender_id = data["sender_id"]
-                            receiver_id = data["receiver_id"]
-                            is_active = await manager.is_user_online(receiver_id)
-                            # print(' ################ send is_active ################ ', is_active)
-                            message = data["message"]
-
-                            # print(' ################ SENDED USER MESSAGE ################ ', message)
-
-                            result = await db.execute(
-                                select(Chat)
-                                .join(chat_users)
-                                .filter(chat_users.c.user_id.in_([sender_id, receiver_id]))
-                                .group_by(Chat.id)
-                                .having(func.count(chat_users.c.user_id) == 2)  # Ensure both users exist in the same chat
-                                .options(selectinload(Chat.messages))
+                            await send_chat_message(
+                                data["sender_id"], data["receiver_id"], data["message"]
                             )
-                            obj = result.scalars().first()
-
-                            if obj is None:
-                                # Save message in the database
-                                chat_form = {
-                                    "sender_id": sender_id,
-                                    "receiver_id": receiver_id,
-                                    "messages": [Message(message=message, read=is_active)]
-                                }
-                                __orm = OrmService(db)
-                                new_chat = await __orm.create(model=Chat, form=chat_form)
-                                await db.execute(
-                                    chat_users.insert().values([
-                                        {"chat_id": new_chat.id, "user_id": sender_id},
-                                        {"chat_id": new_chat.id, "user_id": receiver_id}
-                                    ])
-                                )
-                                await db.commit()
-
-                                obj = new_chat
-
-                                message_data = {
-                                    "info": "new_message",
-                                    "id": new_message.id,
-                                    "message": new_message.message,
-                                    "chat_id": new_message.chat_id,
-                                    "user_id": new_message.user_id,
-                                    "read": new_message.read,
-                                    "created_at": new_message.created_at.isoformat(),  # Convert datetime to string
-                                    "receiver_id": receiver_id,
-                                    "is_active": is_active,
-                                }
-                                await manager.broadcast(json.dumps(message_data))
-
-                            else:
-                                print(' ################ I"M HERE ################ ', message)
-                                print('################ token ################', token)
-                                # Handle messaging
-                                new_message = Message(
-                                    message=message, 
-                                    chat_id=obj.id,
-                                    user_id=sender_id,
-                                    read=is_active,
-                                    created_at=datetime.utcnow()
-                                    )
-                                db.add(new_message)
-                                await db.commit()
-                                await db.refresh(new_message)
-
-                                message_data = {
-                                    "info": "new_message",
-                                    "id": new_message.id,
-                                    "message": new_message.message,
-                                    "chat_id": new_message.chat_id,
-                                    "user_id": new_message.user_id,
-                                    "read": new_message.read,
-                                    "created_at": new_message.created_at.isoformat(),  # Convert datetime to string
-                                    "receiver_id": receiver_id,
-                                    "is_active": is_active,
-                                }
-                                await manager.broadcast(json.dumps(message_data))
                         else:
-                            await manager.broadcast("401 Unauthorized")
+                            await manager.send_personal_message("401 Unauthorized", websocket)
                             # await websocket.close(code=1008)  # Close WebSocket if unauthorized
                             # return
 
                     except WebSocketDisconnect:
-                        print(f"WebSocket client_id {client_id} disconnected.")
-                        message_data = {
-                            "disconnected": True,
-                            "sender_id": sender_id, 
-                            "client_id": client_id,
-                        }
-                        await manager.broadcast(json.dumps(message_data))
-                        manager.disconnect(websocket)
+                        logger.info("Websocket closed", extra={"user_id": current_user.id, "client_id": client_id})
+                        await manager.disconnect(websocket)
                         break
                     except Exception as e:
-                        print(f"Error in WebSocket: {e}")
-                        await manager.broadcast("401 Unauthorized")
+                        logger.warning("Error in websocket: %r", e, extra={"user_id": current_user.id})
+                        # Frees the Connection and its writer, and the user's presence with the last socket
+                        await manager.disconnect(websocket)
+                        await manager.send_personal_message("401 Unauthorized", websocket)
                         await websocket.close()
                         break
 
 
             except WebSocketDisconnect:
-                manager.disconnect(websocket)
-                await manager.broadcast(f"Client #{sender_id} left the chat")
+                await manager.disconnect(websocket)
 
         else:
-            await manager.broadcast("401 Unauthorized")
-            print('################ 401 Unauthorized ################')
+            logger.info("Websocket rejected, unknown user")
             # await websocket.close(code=1008)  # Close WebSocket if unauthorized
             # return
     else:
-        print('################ No Token ################')
+        logger.info("Websocket rejected, no token")
         await websocket.close(code=1008)  # Close WebSocket if no token
-        await manager.broadcast("No token")
         return
     # await manager.connect(websocket, sender_id)
 
@@ -0,0 +1,55 @@
+"""
+Helpers shared by the benchmarks: throwaway users in DATABASE_URL and a
+websocket that drops every frame.
+"""
+import uuid
+
+from sqlalchemy import text
+
+
+class NullWebSocket:
+    """Stands in for a starlette WebSocket and drops every frame."""
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message: str):
+        pass
+
+
+async def create_users(count: int, password: str = "x") -> list:
+    """
+    Insert count users named bench_<tag>_<n>, in one statement.
+
+    Returns their (id, username) rows ordered by id. password is stored as
+    is, pass a hash for users that log in.
+    """
+    # Imported here, the benchmarks without a database do not need DATABASE_URL
+    from db.db import async_session, async_engine
+
+    tag = uuid.uuid4().hex[:8]
+    async with async_session() as db:
+        result = await db.execute(
+            text("""
+                INSERT INTO users (username, email, password)
+                SELECT 'bench_' || :tag || '_' || n, 'bench_' || :tag || '_' || n || '@bench.local', :password
+                FROM generate_series(1, CAST(:count AS integer)) AS n
+                RETURNING id, username
+            """),
+            {"tag": tag, "count": count, "password": password},
+        )
+        users = sorted(result.all())
+        await db.commit()
+    # The pool's connections belong to this event loop, the caller may run
+    # the app on another one
+    await async_engine.dispose()
+    return users
+
+
+async def drop_users(user_ids: list[int]):
+    from db.db import async_session, async_engine
+
+    async with async_session() as db:
+        await db.execute(text("DELETE FROM users WHERE id = ANY(:ids)"), {"ids": list(user_ids)})
+        await db.commit()
+    await async_engine.dispose()
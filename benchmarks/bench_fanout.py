@@ -0,0 +1,64 @@
+"""
+Per-message delivery cost as the number of connected sockets grows.
+
+Compares the targeted send used for chat messages (only the two chat
+participants receive the frame) with a broadcast to every socket.
+
+    python -m benchmarks.bench_fanout --connections 100 1000 10000 --messages 2000
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from benchmarks._support import NullWebSocket
+from ws.manager import ConnectionManager
+
+
+async def run(connections: int, messages: int) -> dict:
+    manager = ConnectionManager()
+    await manager.start()
+    sockets = [NullWebSocket() for _ in range(connections)]
+    for user_id, websocket in enumerate(sockets, start=1):
+        await manager.connect(websocket, user_id)
+
+    frame = json.dumps({"info": "new_message", "message": "x" * 64})
+    pairs = [random.sample(range(1, connections + 1), 2) for _ in range(messages)]
+
+    started = time.perf_counter()
+    for pair in pairs:
+        await manager.send_to_users(pair, frame)
+        await asyncio.sleep(0)
+    targeted = (time.perf_counter() - started) / messages
+
+    # Broadcasting is O(connections) per message, a smaller sample is enough
+    sample = max(1, min(messages, 200_000 // connections))
+    started = time.perf_counter()
+    for _ in range(sample):
+        await manager.broadcast(frame)
+        await asyncio.sleep(0)
+    broadcast = (time.perf_counter() - started) / sample
+
+    await manager.stop()
+    return {
+        "connections": connections,
+        "targeted_us": targeted * 1e6,
+        "broadcast_us": broadcast * 1e6,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connections", type=int, nargs="+", default=[10, 100, 1_000, 10_000])
+    parser.add_argument("--messages", type=int, default=2_000)
+    args = parser.parse_args()
+
+    print(f"{'connections':>12} {'targeted us/msg':>16} {'broadcast us/msg':>17}")
+    for connections in args.connections:
+        row = await run(connections, args.messages)
+        print(f"{row['connections']:>12} {row['targeted_us']:>16.2f} {row['broadcast_us']:>17.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
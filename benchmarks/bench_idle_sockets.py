@@ -0,0 +1,59 @@
+"""
+Pool connections held by connected but idle websockets.
+
+Opens --sockets websockets through the app, lets every one of them send a
+message, then keeps them all open and idle and reads the pool. Sessions are
+per message, so no connection should stay checked out. Exits with status 1
+if any does. Runs against DATABASE_URL and removes its users afterwards.
+
+    python -m benchmarks.bench_idle_sockets --sockets 200
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import sys
+import time
+
+from fastapi.testclient import TestClient
+
+from benchmarks._support import create_users, drop_users
+from db.db import async_engine, pool_stats
+from security.security import create_access_token
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sockets", type=int, default=200)
+    parser.add_argument("--idle", type=float, default=1.0, help="seconds to stay idle before reading the pool")
+    args = parser.parse_args()
+
+    user_ids = [user.id for user in asyncio.run(create_users(args.sockets))]
+    tokens = [asyncio.run(create_access_token({"id": user_id})) for user_id in user_ids]
+
+    from app import app
+
+    with TestClient(app) as client:
+        with contextlib.ExitStack() as sockets:
+            websockets = [
+                sockets.enter_context(client.websocket_connect(f"/ws/{user_id}/{token}"))
+                for user_id, token in zip(user_ids, tokens)
+            ]
+            # Everyone writes to their neighbour once, then goes quiet
+            for n, websocket in enumerate(websockets):
+                receiver_id = user_ids[(n + 1) % len(user_ids)]
+                websocket.send_json({"sender_id": user_ids[n], "receiver_id": receiver_id, "message": "hi"})
+            time.sleep(args.idle)
+            stats = {"sockets": len(websockets), **pool_stats()}
+        client.portal.call(async_engine.dispose)
+
+    asyncio.run(drop_users(user_ids))
+
+    print(json.dumps(stats, indent=2))
+    if stats["checked_out"]:
+        print(f"{stats['checked_out']} connections held by idle sockets", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
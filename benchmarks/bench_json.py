@@ -0,0 +1,93 @@
+"""
+JSON serialization cost per websocket frame and per history page.
+
+- frame: one new_message event, with the stdlib json module and with
+  ws.frames.encode_frame (orjson)
+- page: a get_chat response of --page-size messages, serialized the way
+  FastAPI does for a response_model (serialize_response), then rendered by
+  JSONResponse and by ORJSONResponse. "direct" is pydantic's dump_json
+  straight to bytes, for reference.
+
+Reports microseconds per frame and per page, the best of --repeat runs.
+
+    python -m benchmarks.bench_json --page-size 50 --number 2000
+"""
+import argparse
+import asyncio
+import json
+import timeit
+from datetime import datetime, timezone
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+from pydantic import TypeAdapter
+
+from schemas.chat import ChatPage, MessageBase
+from ws.frames import encode_frame
+
+
+def new_message() -> dict:
+    # As built by app.send_chat_message
+    return {
+        "info": "new_message",
+        "id": 123456,
+        "message": "on my way, running a bit late " * 2,
+        "chat_id": 4321,
+        "user_id": 17,
+        "read": False,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "receiver_id": 42,
+        "is_active": True,
+    }
+
+
+def history_page(size: int) -> list[ChatPage]:
+    now = datetime.now(timezone.utc)
+    messages = [
+        MessageBase(id=n, message=f"message number {n} " * 3, chat_id=4321,
+                    user_id=17 if n % 2 else 42, read=True, created_at=now)
+        for n in range(size, 0, -1)
+    ]
+    return [ChatPage(id=4321, sender_id=17, receiver_id=42, messages=messages,
+                     unread_count=0, next_cursor=1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--number", type=int, default=2000, help="calls per timing run")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    frame = new_message()
+    pages = history_page(args.page_size)
+    field = create_model_field(name="Response_get_chat", type_=list[ChatPage], mode="serialization")
+    adapter = TypeAdapter(list[ChatPage])
+
+    # serialize_response is a coroutine, time it on a running loop
+    loop = asyncio.new_event_loop()
+    content = loop.run_until_complete(serialize_response(field=field, response_content=pages))
+
+    def serialized():
+        return loop.run_until_complete(serialize_response(field=field, response_content=pages))
+
+    cases = {
+        "frame json": lambda: json.dumps(frame),
+        "frame orjson": lambda: encode_frame(frame),
+        "page serialize_response": serialized,
+        "page JSONResponse": lambda: JSONResponse(content).body,
+        "page ORJSONResponse": lambda: ORJSONResponse(content).body,
+        "page direct": lambda: adapter.dump_json(pages),
+    }
+    assert json.loads(JSONResponse(content).body) == json.loads(ORJSONResponse(content).body)
+
+    print(f"{'case':>24} {'us/call':>9}")
+    for name, call in cases.items():
+        best = min(timeit.repeat(call, number=args.number, repeat=args.repeat))
+        print(f"{name:>24} {best / args.number * 1e6:>9.2f}")
+    loop.close()
+
+
+if __name__ == "__main__":
+    main()
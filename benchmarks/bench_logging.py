@@ -0,0 +1,99 @@
+"""
+Frame handling throughput with print, synchronous logging and queued logging.
+
+Every received frame is logged, then delivered through the connection
+manager, like the websocket loop does:
+
+- print: the old print('SENDED DATA:', data, ...) per frame
+- sync: a logging StreamHandler formatting and writing on the event loop
+- sampled: setup_logging() at LOG_LEVEL=DEBUG, formatting and I/O on the
+  listener thread, the frame logger sampled at --sample
+- queue: setup_logging() at the default LOG_LEVEL=INFO, frame records are
+  not even created
+
+Output goes to --output, line buffered like the PYTHONUNBUFFERED=1 stdout
+of the container.
+
+    python -m benchmarks.bench_logging --messages 20000 --sample 0.01
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+from benchmarks._support import NullWebSocket
+from logging_.logging__ import JsonFormatter, setup_logging
+from ws.manager import ConnectionManager
+
+
+async def run(mode: str, messages: int, connections: int) -> float:
+    manager = ConnectionManager()
+    await manager.start()
+    for user_id in range(1, connections + 1):
+        await manager.connect(NullWebSocket(), user_id)
+
+    frame_logger = logging.getLogger("app.frames")
+    frames = [
+        {"sender_id": sender, "receiver_id": receiver, "message": "x" * 64}
+        for sender, receiver in (random.sample(range(1, connections + 1), 2) for _ in range(messages))
+    ]
+
+    started = time.perf_counter()
+    for data in frames:
+        if mode == "print":
+            print('SENDED DATA:', data, "Type:", type(data))
+        else:
+            frame_logger.debug("Frame received", extra={"user_id": data["sender_id"], "keys": sorted(data)})
+        await manager.send_to_users([data["sender_id"], data["receiver_id"]], str(data))
+        await asyncio.sleep(0)
+    elapsed = time.perf_counter() - started
+
+    await manager.stop()
+    return messages / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=20_000)
+    parser.add_argument("--connections", type=int, default=100)
+    parser.add_argument("--sample", type=float, default=0.01)
+    parser.add_argument("--output", default=None, help="file the logs go to, a temporary file by default")
+    args = parser.parse_args()
+
+    output_path = args.output or tempfile.mktemp(prefix="bench_logging_")
+    results = {}
+
+    with open(output_path, "w", buffering=1) as output:
+        stdout, sys.stdout = sys.stdout, output
+        try:
+            results["print"] = asyncio.run(run("print", args.messages, args.connections))
+
+            handler = logging.StreamHandler(output)
+            handler.setFormatter(JsonFormatter())
+            logging.getLogger().handlers[:] = [handler]
+            logging.getLogger().setLevel(logging.DEBUG)
+            results["sync"] = asyncio.run(run("sync", args.messages, args.connections))
+
+            os.environ["LOG_SAMPLE"] = f"app.frames={args.sample}"
+            for mode, level in (("sampled", "DEBUG"), ("queue", "INFO")):
+                os.environ["LOG_LEVEL"] = level
+                listener = setup_logging()
+                results[mode] = asyncio.run(run(mode, args.messages, args.connections))
+                listener.stop()
+        finally:
+            sys.stdout = stdout
+
+    if args.output is None:
+        os.unlink(output_path)
+
+    print(f"{'mode':>8} {'msg/s':>10}")
+    for mode, rate in results.items():
+        print(f"{mode:>8} {rate:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
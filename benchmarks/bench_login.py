@@ -0,0 +1,112 @@
+"""
+Login throughput and event loop lag during a burst of concurrent logins.
+
+--logins logins (--concurrency at a time) go through POST /auth/login in
+process, while a probe measures how late a 10 ms timer fires on the same
+loop. --inline verifies passwords on the event loop like the handlers used
+to, for comparison with the thread pool. Runs against DATABASE_URL and
+removes its users afterwards.
+
+    python -m benchmarks.bench_login --logins 200 --concurrency 50 --rounds 12
+    python -m benchmarks.bench_login --logins 200 --concurrency 50 --rounds 12 --inline
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+from httpx import ASGITransport, AsyncClient
+
+from benchmarks._support import create_users, drop_users
+from db.db import async_engine
+from security import security
+from security.hashing import PasswordHasher
+
+
+class InlineHasher(PasswordHasher):
+    """bcrypt on the event loop, the behaviour before the pool."""
+
+    async def _run(self, func, *args):
+        return func(*args)
+
+
+async def probe_lag(lags: list[float], stop: asyncio.Event, interval: float = 0.01):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - started - interval)
+
+
+def percentile(values: list[float], q: int) -> float:
+    return statistics.quantiles(values, n=100)[q - 1] if len(values) > 1 else values[0]
+
+
+async def run(args) -> dict:
+    hasher_class = InlineHasher if args.inline else PasswordHasher
+    hasher = hasher_class(rounds=args.rounds, max_workers=args.workers, max_pending=args.logins)
+    security.password_hasher = hasher
+
+    # Hash of an older cost makes every login rehash, like after raising BCRYPT_ROUNDS
+    stored_rounds = args.stored_rounds or args.rounds
+    hashed = PasswordHasher(rounds=stored_rounds).context.hash("password")
+    users = await create_users(args.logins, password=hashed)
+    usernames = [user.username for user in users]
+
+    from app import app
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies: list[float] = []
+    statuses: dict[int, int] = {}
+
+    async def login(client: AsyncClient, username: str):
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.post("/auth/login", data={"username": username, "password": "password"})
+            latencies.append(time.perf_counter() - started)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    lags: list[float] = []
+    stop = asyncio.Event()
+    probe = asyncio.create_task(probe_lag(lags, stop))
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://bench") as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(login(client, username) for username in usernames))
+        elapsed = time.perf_counter() - started
+
+    stop.set()
+    await probe
+    await drop_users([user.id for user in users])
+    hasher.shutdown()
+    await async_engine.dispose()
+
+    return {
+        "mode": "inline" if args.inline else "pool",
+        "rounds": args.rounds,
+        "stored_rounds": stored_rounds,
+        "statuses": statuses,
+        "logins_per_s": len(latencies) / elapsed,
+        "login_p50_ms": percentile(latencies, 50) * 1e3,
+        "login_p99_ms": percentile(latencies, 99) * 1e3,
+        "loop_lag_p99_ms": percentile(lags, 99) * 1e3,
+        "loop_lag_max_ms": max(lags) * 1e3,
+        "hasher": hasher.stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=12)
+    parser.add_argument("--stored-rounds", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--inline", action="store_true")
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
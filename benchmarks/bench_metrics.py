@@ -0,0 +1,114 @@
+"""
+Send path cost with metrics on and off.
+
+Runs the same workload in child processes with METRICS_ENABLED=0 and =1,
+alternating for --rounds rounds, since the switch is read at import time.
+Each message is counted as received, stored through
+OrmService.send_message (timed by the engine events) and delivered to its
+two participants through the connection manager. --no-db skips storing.
+Reports median wall and CPU microseconds per message and the overhead.
+
+    python -m benchmarks.bench_metrics --messages 2000 --rounds 5
+    python -m benchmarks.bench_metrics --no-db --connections 1000 --messages 20000
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+
+from benchmarks._support import NullWebSocket
+
+
+async def child(args) -> dict:
+    from metrics.metrics import METRICS_ENABLED
+    from ws.manager import ConnectionManager
+
+    manager = ConnectionManager()
+    await manager.start()
+    for user_id in range(1, args.connections + 1):
+        await manager.connect(NullWebSocket(), user_id)
+
+    frame = json.dumps({"info": "new_message", "message": "x" * 64})
+    pairs = [random.sample(range(1, args.connections + 1), 2) for _ in range(args.messages)]
+
+    orm = None
+    if not args.no_db:
+        from sqlalchemy import text
+        from db.db import async_session, async_engine
+        from orm.orm import OrmService
+
+        tag = uuid.uuid4().hex[:8]
+        db = async_session()
+        user_ids = (await db.execute(
+            text("INSERT INTO users (username, email, password) VALUES (:a, :a_email, 'x'), (:b, :b_email, 'x') RETURNING id"),
+            {"a": f"bench_{tag}_a", "a_email": f"bench_{tag}_a@bench.local",
+             "b": f"bench_{tag}_b", "b_email": f"bench_{tag}_b@bench.local"},
+        )).scalars().all()
+        await db.commit()
+        orm = OrmService(db)
+
+    started, cpu_started = time.perf_counter(), time.process_time()
+    for n, pair in enumerate(pairs):
+        manager.received += 1
+        if orm is not None:
+            await orm.send_message(user_ids[0], user_ids[1], f"message {n}", read=False)
+        await manager.send_to_users(pair, frame)
+        await asyncio.sleep(0)
+    elapsed, cpu = time.perf_counter() - started, time.process_time() - cpu_started
+
+    await manager.stop()
+    if not args.no_db:
+        await db.execute(text("DELETE FROM users WHERE id = ANY(:ids)"), {"ids": list(user_ids)})
+        await db.commit()
+        await db.close()
+        await async_engine.dispose()
+
+    return {
+        "metrics": METRICS_ENABLED,
+        "us_per_message": elapsed / args.messages * 1e6,
+        "cpu_us_per_message": cpu / args.messages * 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connections", type=int, default=1_000)
+    parser.add_argument("--messages", type=int, default=2_000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--no-db", action="store_true", help="do not store the messages in DATABASE_URL")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(asyncio.run(child(args))))
+        return
+
+    results = {"0": [], "1": []}
+    for _ in range(args.rounds):
+        for enabled in results:
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_metrics", "--child", *sys.argv[1:]],
+                env={**os.environ, "METRICS_ENABLED": enabled},
+                capture_output=True, text=True, check=True,
+            ).stdout
+            results[enabled].append(json.loads(output.strip().splitlines()[-1]))
+
+    # Wall time includes the database, CPU time is what this process spends
+    print(f"{'metrics':>8} {'wall us/msg':>12} {'cpu us/msg':>11}")
+    medians = {}
+    for enabled, label in (("0", "off"), ("1", "on")):
+        wall = statistics.median(row["us_per_message"] for row in results[enabled])
+        cpu = statistics.median(row["cpu_us_per_message"] for row in results[enabled])
+        medians[enabled] = (wall, cpu)
+        print(f"{label:>8} {wall:>12.2f} {cpu:>11.2f}")
+    print(f"overhead wall {(medians['1'][0] / medians['0'][0] - 1) * 100:+.1f}%"
+          f" cpu {(medians['1'][1] / medians['0'][1] - 1) * 100:+.1f}%")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+"""
+REST endpoint latency, SQL statements and memory per call, checked against budgets.
+
+For every --sizes dataset (total messages: 1k, 100k, 1m) users, chats and
+messages are loaded into DATABASE_URL by scripts.generate_dataset. Chat
+sizes follow a power law and the chat endpoints read the largest one, so
+history-sized work shows. Each endpoint is then called in-process through
+httpx's ASGI transport, with the app's lifespan running:
+
+- chat: get_chat (latest page and a page from the middle of the history),
+  get_last_mess, all_chats
+- users: all_users, user_profile
+- auth: login, refresh_token
+
+Per endpoint and size it records the median and p95 latency, the SQL
+statements per call and the peak memory allocated during a call
+(tracemalloc, in a separate pass). Every number is checked against
+--budgets. Any call over budget is listed on stderr and the exit status
+is 1, so an endpoint that grew O(history) fails before it ships.
+
+The seeded rows are removed after each size. all_users and all_chats also
+see the rows already in the database, so run it against a dedicated one.
+
+    python -m benchmarks.bench_rest --sizes 1k 100k
+    python -m benchmarks.bench_rest --sizes 1m --iterations 20 --output rest.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+import uuid
+
+# Before app is imported: keep the request logs of httpx and the app out of the timings
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import httpx
+from sqlalchemy import event, func, select, text
+
+from app import app
+from db.db import async_session, async_engine
+from models.users import Chat, Message
+from scripts.generate_dataset import generate
+from security.security import create_access_token, get_password_hash
+
+
+PASSWORD = "bench-password"
+BUDGETS = os.path.join(os.path.dirname(__file__), "rest_budgets.json")
+
+
+def parse_size(value: str) -> int:
+    """'1k' -> 1000, '1m' -> 1000000"""
+    value = value.lower()
+    for suffix, factor in (("k", 1_000), ("m", 1_000_000)):
+        if value.endswith(suffix):
+            return int(float(value[:-1]) * factor)
+    return int(value)
+
+
+class StatementCounter:
+    """Counts the statements the engine sends, calls are made one at a time."""
+
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine.sync_engine, "before_cursor_execute", self.before_cursor_execute)
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+
+async def seed(messages: int) -> dict:
+    """A power-law dataset from scripts.generate_dataset, two chats per user."""
+    tag = uuid.uuid4().hex[:8]
+    users = max(100, min(10_000, messages // 100))
+    password_hash = await get_password_hash(PASSWORD)
+
+    async with async_session() as db:
+        dataset = await generate(
+            db, users=users, chats=users * 2, messages=messages, seed=0,
+            password_hash=password_hash, prefix=f"rest_{tag}_",
+        )
+        hot_chat = await db.get(Chat, dataset["chat_ids"][0])
+
+    return {
+        "tag": tag,
+        "user_ids": dataset["user_ids"],
+        "chat_ids": dataset["chat_ids"],
+        "hot_chat": hot_chat,
+    }
+
+
+async def drop(dataset: dict):
+    # message.user_id has no index: deleting the users first would scan the
+    # whole message table once per user. Chats go first, through the chat_id
+    # index, and VACUUM clears the dead rows before the users are deleted.
+    async with async_session() as db:
+        await db.execute(text("DELETE FROM chat WHERE id = ANY(:ids)"), {"ids": dataset["chat_ids"]})
+        await db.commit()
+    async with async_engine.connect() as conn:
+        await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.execute(text("VACUUM message, chat"))
+    async with async_session() as db:
+        await db.execute(text("DELETE FROM users WHERE id = ANY(:ids)"), {"ids": dataset["user_ids"]})
+        await db.commit()
+
+
+async def endpoints(client: httpx.AsyncClient, dataset: dict):
+    """name -> coroutine function making one call"""
+    hot = dataset["hot_chat"]
+    sender_id, receiver_id = hot.sender_id, hot.receiver_id
+    username = f"rest_{dataset['tag']}_1"
+
+    async with async_session() as db:
+        middle_id = (await db.execute(
+            select(func.percentile_disc(0.5).within_group(Message.id)).filter(Message.chat_id == hot.id)
+        )).scalar()
+
+    response = await client.post("/auth/login", data={"username": username, "password": PASSWORD})
+    response.raise_for_status()
+    refresh = {"token": response.json()["refresh_token"]}
+
+    access = {"token": None, "created": 0.0}
+
+    async def user_profile():
+        # Access tokens live a minute, a slow endpoint before this one outlasts it
+        if time.monotonic() - access["created"] > 30:
+            access["token"] = await create_access_token({"id": sender_id})
+            access["created"] = time.monotonic()
+        return await client.get(
+            f"/users/user_profile/{receiver_id}",
+            params={"user_id": receiver_id},
+            headers={"Authorization": f"Bearer {access['token']}"},
+        )
+
+    async def refresh_token():
+        # Refresh tokens rotate, every call spends the one returned by the last
+        response = await client.post("/auth/refresh_token", params={"refresh_token": refresh["token"]})
+        refresh["token"] = response.json()["refresh_token"]
+        return response
+
+    return {
+        "get_chat": lambda: client.get(
+            "/chat/get_chat", params={"sender_id": sender_id, "receiver_id": receiver_id}
+        ),
+        "get_chat_scroll": lambda: client.get(
+            "/chat/get_chat",
+            params={"sender_id": sender_id, "receiver_id": receiver_id, "before_id": middle_id},
+        ),
+        "get_last_mess": lambda: client.get(
+            "/chat/get_last_mess", params={"sender_id": sender_id, "receiver_id": receiver_id}
+        ),
+        "all_chats": lambda: client.get(
+            "/chat/all_chats", params={"after_id": min(dataset["chat_ids"]) - 1, "messages": 1}
+        ),
+        "all_users": lambda: client.get("/users/all_users"),
+        "user_profile": user_profile,
+        "login": lambda: client.post("/auth/login", data={"username": username, "password": PASSWORD}),
+        "refresh_token": refresh_token,
+    }
+
+
+async def measure(call, iterations: int, statements: StatementCounter) -> dict:
+    for _ in range(2):
+        (await call()).raise_for_status()
+
+    timings = []
+    statements_before = statements.count
+    for _ in range(iterations):
+        started = time.perf_counter()
+        response = await call()
+        timings.append(time.perf_counter() - started)
+        response.raise_for_status()
+    statement_count = (statements.count - statements_before) / iterations
+
+    # tracemalloc slows every allocation down, so memory has a pass of its own
+    peaks = []
+    tracemalloc.start()
+    for _ in range(min(iterations, 3)):
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        (await call()).raise_for_status()
+        peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+    tracemalloc.stop()
+
+    timings.sort()
+    return {
+        "p50_ms": round(statistics.median(timings) * 1e3, 3),
+        "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1e3, 3),
+        "statements": round(statement_count, 2),
+        "peak_kb": round(max(peaks) / 1024, 1),
+    }
+
+
+def over_budget(name: str, size: str, result: dict, budgets: dict) -> list[str]:
+    """A budget is per endpoint, with per-size overrides under "sizes"."""
+    budget = dict(budgets.get(name, {}))
+    budget.update(budget.pop("sizes", {}).get(size, {}))
+    return [
+        f"{name} @ {size}: {metric} {result[metric]} > {limit}"
+        for metric, limit in budget.items()
+        if result.get(metric) is not None and result[metric] > limit
+    ]
+
+
+async def run(args, budgets: dict) -> tuple[list[dict], list[str]]:
+    statements = StatementCounter(async_engine)
+    rows, failures = [], []
+
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for size in args.sizes:
+                started = time.perf_counter()
+                dataset = await seed(parse_size(size))
+                print(f"seeded {size} messages in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+                try:
+                    calls = await endpoints(client, dataset)
+                    for name, call in calls.items():
+                        if args.only and name not in args.only:
+                            continue
+                        iterations = min(args.iterations, args.login_iterations) if name == "login" else args.iterations
+                        result = {"endpoint": name, "size": size, **await measure(call, iterations, statements)}
+                        rows.append(result)
+                        failures.extend(over_budget(name, size, result, budgets))
+                finally:
+                    await drop(dataset)
+    await async_engine.dispose()
+    return rows, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", default=["1k", "100k"], help="messages per dataset, e.g. 1k 100k 1m")
+    parser.add_argument("--iterations", type=int, default=50, help="timed calls per endpoint")
+    parser.add_argument("--login-iterations", type=int, default=5, help="login hashes a password, fewer calls")
+    parser.add_argument("--only", nargs="*", help="endpoints to run, all by default")
+    parser.add_argument("--budgets", default=BUDGETS, help="JSON budgets, benchmarks/rest_budgets.json by default")
+    parser.add_argument("--output", default=None, help="file the JSON results go to")
+    args = parser.parse_args()
+
+    with open(args.budgets) as budgets_file:
+        budgets = json.load(budgets_file)
+
+    rows, failures = asyncio.run(run(args, budgets))
+
+    print(f"{'endpoint':>16} {'size':>6} {'p50 ms':>9} {'p95 ms':>9} {'stmts':>6} {'peak KB':>9}")
+    for row in rows:
+        print(f"{row['endpoint']:>16} {row['size']:>6} {row['p50_ms']:>9.2f} {row['p95_ms']:>9.2f}"
+              f" {row['statements']:>6.1f} {row['peak_kb']:>9.1f}")
+    if args.output is not None:
+        with open(args.output, "w") as output:
+            json.dump({"results": rows, "failures": failures}, output, indent=2)
+
+    if failures:
+        print("over budget:", *failures, sep="\n  ", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
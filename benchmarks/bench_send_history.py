@@ -0,0 +1,92 @@
+"""
+Send latency against chat history length.
+
+Seeds one chat per history size with generate_series, then times
+OrmService.send_message into each of them. Latency should not depend on how
+many messages the chat already holds. Runs against DATABASE_URL and removes
+its users (and with them, their chats and messages) afterwards.
+
+    python -m benchmarks.bench_send_history --history 0 10000 200000 --sends 300
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+
+from sqlalchemy import text
+
+from db.db import async_session, async_engine
+from orm.orm import OrmService
+
+
+async def create_user(db, tag: str) -> int:
+    result = await db.execute(
+        text("INSERT INTO users (username, email, password) VALUES (:name, :email, 'x') RETURNING id"),
+        {"name": tag, "email": f"{tag}@bench.local"},
+    )
+    return result.scalar_one()
+
+
+async def seed_chat(history: int) -> tuple[int, int]:
+    tag = uuid.uuid4().hex[:8]
+    async with async_session() as db:
+        sender_id = await create_user(db, f"bench_{tag}_a")
+        receiver_id = await create_user(db, f"bench_{tag}_b")
+        await db.commit()
+
+        chat_id = await OrmService(db).get_or_create_chat(sender_id, receiver_id)
+        await db.execute(
+            text("""
+                INSERT INTO message (message, chat_id, user_id, read, created_at)
+                SELECT 'history ' || n, CAST(:chat_id AS integer),
+                       CASE WHEN n % 2 = 0 THEN CAST(:sender_id AS integer) ELSE CAST(:receiver_id AS integer) END,
+                       true, NOW() - (CAST(:history AS integer) - n) * INTERVAL '1 second'
+                FROM generate_series(1, CAST(:history AS integer)) AS n
+            """),
+            {"chat_id": chat_id, "sender_id": sender_id, "receiver_id": receiver_id, "history": history},
+        )
+        await db.commit()
+    return sender_id, receiver_id
+
+
+async def run(history: int, sends: int) -> dict:
+    sender_id, receiver_id = await seed_chat(history)
+
+    timings = []
+    async with async_session() as db:
+        orm = OrmService(db)
+        # Warm the chat cache like a live socket would
+        await orm.send_message(sender_id, receiver_id, "warmup", read=False)
+        for n in range(sends):
+            started = time.perf_counter()
+            await orm.send_message(sender_id, receiver_id, f"message {n}", read=False)
+            timings.append(time.perf_counter() - started)
+
+        await db.execute(text("DELETE FROM users WHERE id IN (:a, :b)"), {"a": sender_id, "b": receiver_id})
+        await db.commit()
+
+    timings.sort()
+    return {
+        "history": history,
+        "p50_ms": statistics.median(timings) * 1e3,
+        "p99_ms": timings[int(len(timings) * 0.99) - 1] * 1e3,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--history", type=int, nargs="+", default=[0, 10_000, 200_000])
+    parser.add_argument("--sends", type=int, default=300)
+    args = parser.parse_args()
+
+    print(f"{'history':>10} {'p50 ms':>8} {'p99 ms':>8}")
+    for history in args.history:
+        row = await run(history, args.sends)
+        print(f"{row['history']:>10} {row['p50_ms']:>8.3f} {row['p99_ms']:>8.3f}")
+
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
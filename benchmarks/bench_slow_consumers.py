@@ -0,0 +1,95 @@
+"""
+Delivery latency of healthy clients while a few clients are slow.
+
+Healthy sockets accept frames immediately, slow ones take --slow-delay
+seconds per frame. Every tick one presence frame is broadcast and latency is
+measured from broadcast to send_text on the healthy sockets.
+
+    python -m benchmarks.bench_slow_consumers --healthy 500 --slow 5 --policy drop_oldest
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+from ws.connection import OVERFLOW_POLICIES
+from ws.manager import ConnectionManager
+
+
+class HealthyWebSocket:
+    def __init__(self, latencies: list[float]):
+        self.latencies = latencies
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message: str):
+        self.latencies.append(time.perf_counter() - json.loads(message)["sent_at"])
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+class SlowWebSocket:
+    def __init__(self, delay: float):
+        self.delay = delay
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message: str):
+        await asyncio.sleep(self.delay)
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+def percentile(values: list[float], q: float) -> float:
+    return statistics.quantiles(values, n=100)[q - 1] if len(values) > 1 else values[0]
+
+
+async def run(args) -> dict:
+    manager = ConnectionManager(max_queue=args.queue, overflow_policy=args.policy)
+    await manager.start()
+
+    latencies: list[float] = []
+    sockets = [HealthyWebSocket(latencies) for _ in range(args.healthy)]
+    sockets += [SlowWebSocket(args.slow_delay) for _ in range(args.slow)]
+    for user_id, websocket in enumerate(sockets, start=1):
+        await manager.connect(websocket, user_id)
+
+    for tick in range(args.frames):
+        frame = json.dumps({"is active": tick % 10, "sent_at": time.perf_counter()})
+        await manager.broadcast(frame, key=f"presence:{tick % 10}")
+        await asyncio.sleep(args.interval)
+
+    await asyncio.sleep(0.05)
+    stats = manager.queue_stats()
+    await manager.stop()
+
+    return {
+        "policy": args.policy,
+        "delivered": len(latencies),
+        "p50_ms": percentile(latencies, 50) * 1e3,
+        "p99_ms": percentile(latencies, 99) * 1e3,
+        **stats,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--healthy", type=int, default=500)
+    parser.add_argument("--slow", type=int, default=5)
+    parser.add_argument("--slow-delay", type=float, default=0.05)
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--interval", type=float, default=0.002)
+    parser.add_argument("--queue", type=int, default=32)
+    parser.add_argument("--policy", choices=OVERFLOW_POLICIES, default="drop_oldest")
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Message persistence throughput: per-message commit versus write-behind.
+
+--senders concurrent coroutines (one per simulated socket) each store
+--messages messages into their own chat, once through the direct
+INSERT ... RETURNING + commit path and once through MessageWriter.
+Runs against DATABASE_URL and removes its users afterwards.
+
+    python -m benchmarks.bench_write_behind --senders 50 --messages 20 --batch 100 --delay-ms 5
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+from sqlalchemy import text
+
+from db.db import async_session, async_engine
+from orm.orm import OrmService
+from orm.writer import MessageWriter
+
+
+async def create_pairs(count: int) -> list[tuple[int, int]]:
+    tag = uuid.uuid4().hex[:8]
+    async with async_session() as db:
+        result = await db.execute(
+            text("""
+                INSERT INTO users (username, email, password)
+                SELECT 'bench_' || :tag || '_' || n, 'bench_' || :tag || '_' || n || '@bench.local', 'x'
+                FROM generate_series(1, CAST(:count AS integer)) AS n
+                RETURNING id
+            """),
+            {"tag": tag, "count": count * 2},
+        )
+        ids = sorted(result.scalars().all())
+        await db.commit()
+    return list(zip(ids[::2], ids[1::2]))
+
+
+async def drop_pairs(pairs: list[tuple[int, int]]):
+    async with async_session() as db:
+        await db.execute(
+            text("DELETE FROM users WHERE id = ANY(:ids)"),
+            {"ids": [user_id for pair in pairs for user_id in pair]},
+        )
+        await db.commit()
+
+
+async def sender(pair: tuple[int, int], messages: int, writer: MessageWriter | None):
+    async with async_session() as db:
+        orm = OrmService(db)
+        for n in range(messages):
+            await orm.send_message(pair[0], pair[1], f"message {n}", read=False, writer=writer)
+
+
+async def run(pairs, messages: int, writer: MessageWriter | None) -> float:
+    if writer is not None:
+        await writer.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(sender(pair, messages, writer) for pair in pairs))
+    elapsed = time.perf_counter() - started
+    if writer is not None:
+        await writer.stop()
+    return len(pairs) * messages / elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--senders", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--batch", type=int, default=100)
+    parser.add_argument("--delay-ms", type=float, default=5)
+    args = parser.parse_args()
+
+    pairs = await create_pairs(args.senders)
+    # Resolve every chat once so both runs measure only the message writes
+    await run(pairs, 1, None)
+
+    direct = await run(pairs, args.messages, None)
+    writer = MessageWriter(async_session, max_batch=args.batch, max_delay=args.delay_ms / 1000)
+    batched = await run(pairs, args.messages, writer)
+
+    await drop_pairs(pairs)
+    await async_engine.dispose()
+
+    print(f"per-message commit: {direct:>10.0f} msg/s")
+    print(f"write-behind:       {batched:>10.0f} msg/s  ({writer.written / writer.batches:.1f} msg/batch)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
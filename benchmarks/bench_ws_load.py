@@ -0,0 +1,294 @@
+"""
+Websocket load generator: concurrent chatters and messages per second of one worker.
+
+Starts app:app under uvicorn in a child process against DATABASE_URL (a
+local Postgres, not production), creates --connections users and opens one
+authenticated websocket per user on /ws/{sender_id}/{token}. Messages are
+then sent between random pairs at --rate messages per second for
+--duration seconds, open loop, so a slow server shows up as latency rather
+than as a lower send rate.
+
+Latency is from the send on the sender's socket to the new_message frame on
+the receiver's socket, both timed in this process. The worker's CPU time and
+RSS are read from /proc, so the numbers are for Linux. CPU is reported per
+message and per connection: the cost of opening one, and its share of the
+load phase.
+
+The worker inherits this environment, so MESSAGE_WRITE_BEHIND and the
+batching settings apply to it, and they are recorded with the result.
+
+The result is one JSON object, on stdout or in --output, to be kept and
+compared release over release:
+
+    python -m benchmarks.bench_ws_load --connections 500 --rate 1000 --duration 20
+    python -m benchmarks.bench_ws_load --connections 2000 --rate 200 --output ws_load.json
+    python -m benchmarks.bench_ws_load --rate 2000 --batch --send-batch 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+from websockets.asyncio.client import connect
+
+from benchmarks._support import create_users, drop_users
+from orm.writer import MessageWriter
+from security.security import create_access_token
+
+
+# Marks the frames sent by this benchmark, followed by the sequence number
+PREFIX = "load:"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def process_usage(pid: int) -> dict:
+    """CPU seconds and resident memory of a process, from /proc."""
+    with open(f"/proc/{pid}/stat") as stat:
+        # The command name may contain spaces, the fields after it do not
+        fields = stat.read().rsplit(")", 1)[1].split()
+    ticks = os.sysconf("SC_CLK_TCK")
+    with open(f"/proc/{pid}/statm") as statm:
+        rss_pages = int(statm.read().split()[1])
+    return {
+        "cpu_seconds": (int(fields[11]) + int(fields[12])) / ticks,
+        "rss_bytes": rss_pages * os.sysconf("SC_PAGE_SIZE"),
+    }
+
+
+def percentile(values: list[float], q: float) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+async def wait_for_port(port: int, server: subprocess.Popen, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"server exited with status {server.returncode}")
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+        except OSError:
+            await asyncio.sleep(0.1)
+            continue
+        writer.close()
+        await writer.wait_closed()
+        return
+    raise TimeoutError(f"server did not listen on {port} within {timeout}s")
+
+
+class Client:
+    """One chatter: a websocket and the task reading every frame it gets."""
+
+    def __init__(self, user_id: int, websocket, sent: dict[int, float], latencies: list[float]):
+        self.user_id = user_id
+        self.websocket = websocket
+        self.sent = sent
+        self.latencies = latencies
+        self.frames = 0
+        self.reader = asyncio.create_task(self.read())
+
+    async def read(self):
+        async for frame in self.websocket:
+            received = time.perf_counter()
+            self.frames += 1
+            if PREFIX not in frame:
+                continue
+            data = json.loads(frame)
+            # With --batch several events may share a frame
+            for event in data if isinstance(data, list) else [data]:
+                # The sender gets its own message back, only the receiver's copy counts
+                if not isinstance(event, dict) or event.get("info") != "new_message" or event.get("receiver_id") != self.user_id:
+                    continue
+                started = self.sent.pop(int(event["message"][len(PREFIX):]), None)
+                if started is not None:
+                    self.latencies.append(received - started)
+
+
+async def drive(args, port: int, user_ids: list[int], server_pid: int) -> dict:
+    sent: dict[int, float] = {}
+    latencies: list[float] = []
+    tokens = [await create_access_token({"id": user_id}) for user_id in user_ids]
+
+    usage_idle = process_usage(server_pid)
+    connect_started = time.perf_counter()
+    clients = []
+    for start in range(0, len(user_ids), args.connect_batch):
+        batch = zip(user_ids[start:start + args.connect_batch], tokens[start:start + args.connect_batch])
+        websockets = await asyncio.gather(*(
+            connect(
+                f"ws://127.0.0.1:{port}/ws/{user_id}/{token}{'?batch=1' if args.batch else ''}",
+                max_size=None, ping_interval=None,
+            )
+            for user_id, token in batch
+        ))
+        clients.extend(
+            Client(user_id, websocket, sent, latencies)
+            for user_id, websocket in zip(user_ids[start:], websockets)
+        )
+    connect_seconds = time.perf_counter() - connect_started
+
+    # Let the presence broadcasts of the connect phase drain
+    await asyncio.sleep(args.settle)
+    usage_connected = process_usage(server_pid)
+
+    random.seed(args.seed)
+    total = int(args.rate * args.duration)
+    cpu_started = usage_connected["cpu_seconds"]
+    started = time.perf_counter()
+    for first in range(0, total, args.send_batch):
+        # Open loop: wait for the slot of this frame, never for the server
+        delay = started + first / args.rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        sender = random.choice(clients)
+        messages = []
+        for seq in range(first, min(first + args.send_batch, total)):
+            receiver = sender
+            while receiver is sender:
+                receiver = random.choice(clients)
+            messages.append({
+                "sender_id": sender.user_id,
+                "receiver_id": receiver.user_id,
+                "message": f"{PREFIX}{seq}",
+            })
+        now = time.perf_counter()
+        for seq in range(first, first + len(messages)):
+            sent[seq] = now
+        # --send-batch above 1 sends the messages of a frame as one array
+        await sender.websocket.send(json.dumps(messages if args.send_batch > 1 else messages[0]))
+    send_seconds = time.perf_counter() - started
+
+    # Wait for the stragglers, up to --drain seconds
+    deadline = time.perf_counter() + args.drain
+    while sent and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - started
+    usage_loaded = process_usage(server_pid)
+
+    for client in clients:
+        client.reader.cancel()
+    await asyncio.gather(*(client.websocket.close() for client in clients), return_exceptions=True)
+
+    cpu_seconds = usage_loaded["cpu_seconds"] - cpu_started
+    connect_cpu_seconds = usage_connected["cpu_seconds"] - usage_idle["cpu_seconds"]
+    latencies_ms = [round(latency * 1e3, 3) for latency in latencies]
+    return {
+        "connect_seconds": round(connect_seconds, 3),
+        "sent": total,
+        "delivered": len(latencies),
+        "lost": len(sent),
+        "send_rate": round(total / send_seconds, 1),
+        "throughput": round(len(latencies) / elapsed, 1),
+        "frames_received": sum(client.frames for client in clients),
+        "latency_ms": {
+            "p50": percentile(latencies_ms, 50),
+            "p90": percentile(latencies_ms, 90),
+            "p99": percentile(latencies_ms, 99),
+            "max": max(latencies_ms, default=None),
+            "mean": round(statistics.fmean(latencies_ms), 3) if latencies_ms else None,
+        },
+        "server": {
+            "cpu_seconds": round(cpu_seconds, 3),
+            "cpu_percent": round(cpu_seconds / elapsed * 100, 1),
+            "cpu_us_per_message": round(cpu_seconds / max(1, len(latencies)) * 1e6, 1),
+            # Accepting, authenticating and announcing one socket
+            "cpu_ms_per_connect": round(connect_cpu_seconds / len(clients) * 1e3, 3),
+            "cpu_percent_per_connection": round(cpu_seconds / elapsed * 100 / len(clients), 4),
+            "rss_idle_bytes": usage_idle["rss_bytes"],
+            "rss_connected_bytes": usage_connected["rss_bytes"],
+            "rss_loaded_bytes": usage_loaded["rss_bytes"],
+            "rss_per_connection_bytes": round(
+                (usage_connected["rss_bytes"] - usage_idle["rss_bytes"]) / len(clients)
+            ),
+        },
+    }
+
+
+async def run(args) -> dict:
+    user_ids = [user.id for user in await create_users(args.connections)]
+
+    port = free_port()
+    # The worker logs to stdout, which is where the result goes
+    server_log = open(args.server_log or os.devnull, "w")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        env={**os.environ, "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING")},
+        stdout=server_log, stderr=subprocess.STDOUT,
+    )
+    try:
+        await wait_for_port(port, server)
+        result = await drive(args, port, user_ids, server.pid)
+    finally:
+        server.send_signal(signal.SIGINT)
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        server_log.close()
+        await drop_users(user_ids)
+
+    writer = MessageWriter.from_env(None)
+    return {
+        "benchmark": "ws_load",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "config": {
+            "connections": args.connections,
+            "rate": args.rate,
+            "duration": args.duration,
+            "seed": args.seed,
+            "batch": args.batch,
+            "send_batch": args.send_batch,
+            # As the worker reads them, see MessageWriter.from_env and ConnectionManager
+            "message_write_behind": writer is not None,
+            "message_batch_size": writer.max_batch if writer is not None else None,
+            "message_batch_delay_ms": writer.max_delay * 1000 if writer is not None else None,
+            "ws_batch_max": int(os.getenv("WS_BATCH_MAX", 50)),
+            "ws_batch_window_ms": float(os.getenv("WS_BATCH_WINDOW_MS", 5)),
+        },
+        **result,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connections", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=500, help="messages per second, over all connections")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of sending")
+    parser.add_argument("--drain", type=float, default=10, help="seconds to wait for late deliveries")
+    parser.add_argument("--settle", type=float, default=1, help="seconds between connecting and sending")
+    parser.add_argument("--connect-batch", type=int, default=100, help="websockets opened at once")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch", action="store_true", help="negotiate batched frames from the server (?batch=1)")
+    parser.add_argument("--send-batch", type=int, default=1, help="messages per client frame, sent as an array")
+    parser.add_argument("--output", default=None, help="file the JSON result goes to, stdout by default")
+    parser.add_argument("--server-log", default=None, help="file the worker's output goes to, discarded by default")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    report = json.dumps(result, indent=2)
+    if args.output is None:
+        print(report)
+    else:
+        with open(args.output, "w") as output:
+            output.write(report + "\n")
+
+
+if __name__ == "__main__":
+    main()
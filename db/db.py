@@ -3,16 +3,98 @@ from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.ext.declarative import DeclarativeMeta, declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.future import select
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 from dotenv import load_dotenv
 import os
+import time
 
 load_dotenv()
 
+# After load_dotenv, METRICS_ENABLED may come from .env
+from metrics.metrics import METRICS_ENABLED, instrument_engine
+
 
 Base = declarative_base()
 
-async_engine = create_async_engine(os.getenv("DATABASE_URL"), echo=True)
+
+def env_flag(name: str, default: bool) -> bool:
+    return os.getenv(name, str(default)).lower() in ("1", "true", "yes")
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """The regular asyncio queue pool, also timing how long checkouts wait."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except Exception:
+            self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            self.checkouts += 1
+            self.wait_time_total += waited
+            self.wait_time_max = max(self.wait_time_max, waited)
+
+    def recreate(self):
+        # Keep the counters of the pool being replaced
+        pool = super().recreate()
+        pool.checkouts, pool.timeouts = self.checkouts, self.timeouts
+        pool.wait_time_total, pool.wait_time_max = self.wait_time_total, self.wait_time_max
+        return pool
+
+
+def engine_options(url: str) -> dict:
+    """
+    Engine settings from the environment.
+
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT (s), DB_POOL_RECYCLE (s),
+    DB_POOL_PRE_PING and DB_ECHO tune the pool. With asyncpg,
+    DB_STATEMENT_CACHE_SIZE sets the prepared statement cache per connection
+    (0 behind pgbouncer in transaction mode) and DB_STATEMENT_TIMEOUT_MS the
+    server-side statement_timeout.
+
+    DB_POOL_PRE_PING is off by default: it costs a round trip on every
+    checkout, and connections older than DB_POOL_RECYCLE are replaced
+    anyway. Turn it on where the server or a proxy drops idle connections
+    sooner than that.
+    """
+    options = {
+        "echo": env_flag("DB_ECHO", False),
+        "poolclass": TimedQueuePool,
+        "pool_size": int(os.getenv("DB_POOL_SIZE", 10)),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", 10)),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", 30)),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", 1800)),
+        "pool_pre_ping": env_flag("DB_POOL_PRE_PING", False),
+    }
+
+    if "+asyncpg" in url:
+        connect_args = {
+            "prepared_statement_cache_size": int(os.getenv("DB_STATEMENT_CACHE_SIZE", 500)),
+        }
+        statement_timeout = os.getenv("DB_STATEMENT_TIMEOUT_MS")
+        if statement_timeout:
+            connect_args["server_settings"] = {"statement_timeout": statement_timeout}
+        options["connect_args"] = connect_args
+
+    return options
+
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+async_engine = create_async_engine(DATABASE_URL, **engine_options(DATABASE_URL))
+if METRICS_ENABLED:
+    instrument_engine(async_engine)
 async_session = sessionmaker(
     async_engine, expire_on_commit=False, class_=AsyncSession
 )
@@ -20,3 +102,25 @@ async_session = sessionmaker(
 async def get_db():
     async with async_session() as session:
         yield session
+
+
+def pool_stats() -> dict:
+    """Connections of this worker's pool and how long checkouts waited for one."""
+    pool = async_engine.pool
+    stats = {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": pool.overflow(),
+        "max_overflow": pool._max_overflow,
+        "timeout": pool.timeout(),
+    }
+    if isinstance(pool, TimedQueuePool):
+        checkouts = pool.checkouts or 1
+        stats.update({
+            "checkouts": pool.checkouts,
+            "timeouts": pool.timeouts,
+            "wait_ms_avg": pool.wait_time_total / checkouts * 1e3,
+            "wait_ms_max": pool.wait_time_max * 1e3,
+        })
+    return stats
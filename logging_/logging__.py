@@ -0,0 +1,101 @@
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with the fields passed as extra= next to the message."""
+
+    # Attributes every LogRecord has, anything else came in through extra=
+    reserved = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in self.reserved:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class SampleFilter(logging.Filter):
+    """
+    Keeps one in every round(1 / rate) records below WARNING.
+
+    Meant for loggers that fire on every frame. Warnings and errors always
+    pass, and the kept records carry how many they stand for as "sampled".
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.every = max(1, round(1 / rate)) if rate > 0 else 0
+        self.seen = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        if not self.every:
+            return False
+        self.seen += 1
+        if self.seen % self.every:
+            return False
+        record.sampled = self.every
+        return True
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves the record alone.
+
+    The stock prepare() formats the message in the calling thread so the
+    record can be pickled. The queue never leaves the process, so formatting
+    is left to the listener thread, off the event loop.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def parse_samples(value: str) -> dict[str, float]:
+    """'app.frames=0.01,ws.manager=0.1' -> {'app.frames': 0.01, 'ws.manager': 0.1}"""
+    samples = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, rate = item.partition("=")
+        samples[name.strip()] = float(rate)
+    return samples
+
+
+def setup_logging() -> logging.handlers.QueueListener:
+    """
+    Route every logger through a queue to a stdout handler on its own thread.
+
+    LOG_LEVEL sets the root level (INFO by default), LOG_FORMAT=json|text the
+    output and LOG_SAMPLE per-logger sampling rates, e.g. "app.frames=0.01".
+    Returns the started listener, stop() it on shutdown to flush.
+    """
+    stream = logging.StreamHandler(sys.stdout)
+    if os.getenv("LOG_FORMAT", "json") == "json":
+        stream.setFormatter(JsonFormatter())
+    else:
+        stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers[:] = [DeferredQueueHandler(log_queue)]
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+
+    for name, rate in parse_samples(os.getenv("LOG_SAMPLE", "app.frames=0.01")).items():
+        logging.getLogger(name).addFilter(SampleFilter(rate))
+
+    listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -0,0 +1,125 @@
+import os
+import re
+import time
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from starlette.requests import Request
+from starlette.responses import Response
+
+
+# METRICS_ENABLED=0 leaves every hot path uninstrumented
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1").lower() in ("1", "true", "yes")
+
+
+http_request_duration = Histogram(
+    "chat_http_request_duration_seconds",
+    "HTTP request latency by route template",
+    ["method", "route", "status"],
+)
+db_query_duration = Histogram(
+    "chat_db_query_duration_seconds",
+    "Database statement latency by statement kind and table",
+    ["statement"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+
+
+class HTTPMetricsMiddleware:
+    """Per-route latency histogram, labelled with the route template so ids do not explode the series."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            http_request_duration.labels(
+                scope["method"],
+                route.path if route is not None else "unmatched",
+                str(status_code),
+            ).observe(time.perf_counter() - started)
+
+
+_table_pattern = re.compile(r"\b(?:FROM|INTO|UPDATE)\s+([a-z_][a-z0-9_]*)", re.IGNORECASE)
+# statement text -> label, SQLAlchemy caches compiled statements so the set is small
+_statement_labels: dict[str, str] = {}
+
+
+def statement_label(statement: str) -> str:
+    """'SELECT chat', 'INSERT message', ... for a compiled statement"""
+    label = _statement_labels.get(statement)
+    if label is None:
+        words = statement.split(None, 1)
+        kind = words[0].upper() if words else "?"
+        match = _table_pattern.search(statement)
+        label = f"{kind} {match.group(1) if match is not None else '?'}"
+        if len(_statement_labels) < 10_000:
+            _statement_labels[statement] = label
+    return label
+
+
+def instrument_engine(engine):
+    """Time every statement of the engine through cursor execute events."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        db_query_duration.labels(statement_label(statement)).observe(time.perf_counter() - started)
+
+    @event.listens_for(engine.sync_engine, "handle_error")
+    def handle_error(context):
+        started = context.connection.info.get("query_started") if context.connection is not None else None
+        if started:
+            started.pop()
+
+
+class StatsCollector:
+    """
+    Exposes a stats() dict (pool, sockets, bcrypt) as gauges at scrape time.
+
+    Keys listed in counters are exported as counters. The hot paths only bump
+    plain integers, the numbers are read when Prometheus asks.
+    """
+
+    def __init__(self, prefix: str, stats, counters: tuple[str, ...] = ()):
+        self.prefix = prefix
+        self.stats = stats
+        self.counters = counters
+
+    def collect(self):
+        for key, value in self.stats().items():
+            if not isinstance(value, (int, float)) or isinstance(value, bool):
+                continue
+            name = f"{self.prefix}_{key}"
+            if key in self.counters:
+                yield CounterMetricFamily(name, f"{self.prefix} {key}", value=value)
+            else:
+                yield GaugeMetricFamily(name, f"{self.prefix} {key}", value=value)
+
+
+def register_stats(prefix: str, stats, counters: tuple[str, ...] = ()):
+    REGISTRY.register(StatsCollector(prefix, stats, counters))
+
+
+async def metrics_endpoint(request: Request) -> Response:
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
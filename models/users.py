@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Table
+from sqlalchemy import BigInteger, Column, Integer, String, Boolean, ForeignKey, Table, Index, Text
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql.expression import false, text
 from sqlalchemy.sql.sqltypes import TIMESTAMP
@@ -10,7 +10,12 @@ chat_users = Table(
     'chat_users',
     Base.metadata,
     Column('chat_id', ForeignKey('chat.id', ondelete="CASCADE"), primary_key=True),
-    Column('user_id', ForeignKey('users.id', ondelete="CASCADE"), primary_key=True)
+    Column('user_id', ForeignKey('users.id', ondelete="CASCADE"), primary_key=True),
+    # Messages of the other participants this user has not read yet
+    Column('unread_count', Integer, server_default=text("0"), nullable=False),
+    # Every message of the other participants up to this id has been read
+    Column('last_read_message_id', Integer, nullable=True),
+    Index('ix_chat_users_user_id', 'user_id'),
 )
 
 
@@ -51,6 +56,16 @@ class Chat(Base):
     receiver_id = Column(ForeignKey("users.id", ondelete="CASCADE"))
     messages = Column(String, nullable=True)
     unread_count = Column(Integer, nullable=True, default=0)
+    # Canonical (min, max) user pair, one chat per pair
+    user_low_id = Column(ForeignKey("users.id", ondelete="CASCADE"))
+    user_high_id = Column(ForeignKey("users.id", ondelete="CASCADE"))
+    # Summary maintained by the send path, see OrmService.send_message
+    last_message_id = Column(Integer, nullable=True)
+    last_message_at = Column(TIMESTAMP(timezone=True), nullable=True)
+
+    __table_args__ = (
+        Index("ix_chat_user_pair", "user_low_id", "user_high_id", unique=True),
+    )
 
     participants = relationship(
         "User",
@@ -85,3 +100,28 @@ class Message(Base):
         "User",
         back_populates="messages"
     )
+
+
+# Keyset pagination of a chat history walks this index backwards from a cursor
+Index("ix_message_chat_id_id", Message.chat_id, Message.id.desc())
+
+
+class UserSession(Base):
+    """A refresh-token session, see security.sessions.DatabaseSessionStore"""
+    __tablename__ = "user_sessions"
+
+    id = Column(String, primary_key=True)
+    user_id = Column(ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    expires_at = Column(TIMESTAMP(timezone=True), nullable=False, index=True)
+
+
+# Backplane envelopes too large for NOTIFY, see PostgresBackplane.publish
+fanout_payload = Table(
+    'fanout_payload',
+    Base.metadata,
+    Column('id', BigInteger, primary_key=True),
+    Column('payload', Text, nullable=False),
+    Column('created_at', TIMESTAMP(timezone=True), server_default=text("NOW()"), nullable=False),
+    Index('ix_fanout_payload_created_at', 'created_at'),
+    prefixes=['UNLOGGED'],
+)
@@ -1,10 +1,31 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy.orm import selectinload, joinedload
+from sqlalchemy.orm import selectinload, joinedload, aliased
+from sqlalchemy import func, update, case, or_, true
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
 from fastapi import HTTPException, Depends, status
+from cachetools import LRUCache
+import logging
+
+from models.users import Chat, Message, User, chat_users
+from security.security import forget_user, verify_and_update_password, get_tokens_pair
+
+
+logger = logging.getLogger(__name__)
+
+# Participants of a chat never change once it is created
+participants_cache = LRUCache(maxsize=100_000)
+# (low user id, high user id) -> chat id
+chat_pair_cache = LRUCache(maxsize=100_000)
+
+
+def forget_chat(chat_id: int, pair: tuple[int, int] | None = None):
+    """Drop a deleted chat from the in-process caches."""
+    participants_cache.pop(chat_id, None)
+    if pair is not None:
+        chat_pair_cache.pop(pair, None)
 
-from models.users import User
-from security.security import verify_password, get_tokens_pair
 
 class OrmService:
     def __init__(self, db):
@@ -12,19 +33,29 @@ class OrmService:
 
     
     async def login(self, form):
-        print('------------------LOGIN--FORM--------------', form.username)
+        logger.debug("Login attempt", extra={"username": form.username})
         result = await self.db.execute(select(User).filter(User.username == form.username))  # Await the query execution
         user = result.scalar_one_or_none() 
         if not user:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid Credentials")
 
-        if not verify_password(form.password, user.password):
+        verified, new_hash = await verify_and_update_password(form.password, user.password)
+        if not verified:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid Credentials")
-        
-        user.is_active = True
-        await self.db.commit()
- 
-        return await get_tokens_pair(db=self.db, id=user.id)
+        # Tokens live in the session store, the users row is only written on change
+        changed = False
+        if new_hash is not None:
+            # Made with an older BCRYPT_ROUNDS
+            user.password = new_hash
+            changed = True
+        if not user.is_active:
+            user.is_active = True
+            changed = True
+        if changed:
+            await self.db.commit()
+            forget_user(user.id)
+
+        return await get_tokens_pair(user)
 
     
     async def all(self, model, name):
@@ -53,6 +84,372 @@ class OrmService:
         return obj
     
 
+    async def get_or_create_chat(self, sender_id: int, receiver_id: int, commit: bool = True) -> int:
+        """
+        Id of the 1:1 chat of two users, created on their first message.
+
+        The insert relies on the unique (user_low_id, user_high_id) index, so
+        two simultaneous first messages still end up in one chat. With commit
+        False a new chat is left in the caller's transaction and not cached,
+        the caller caches it once committed.
+        """
+        pair = (min(sender_id, receiver_id), max(sender_id, receiver_id))
+
+        chat_id = chat_pair_cache.get(pair)
+        if chat_id is not None:
+            return chat_id
+
+        result = await self.db.execute(
+            insert(Chat)
+            .values(
+                sender_id=sender_id,
+                receiver_id=receiver_id,
+                user_low_id=pair[0],
+                user_high_id=pair[1],
+            )
+            .on_conflict_do_nothing(index_elements=["user_low_id", "user_high_id"])
+            .returning(Chat.id)
+        )
+        chat_id = result.scalar_one_or_none()
+
+        if chat_id is None:
+            result = await self.db.execute(
+                select(Chat.id).filter(Chat.user_low_id == pair[0], Chat.user_high_id == pair[1])
+            )
+            chat_id = result.scalar_one()
+        else:
+            await self.db.execute(
+                insert(chat_users)
+                .values([
+                    {"chat_id": chat_id, "user_id": pair[0]},
+                    {"chat_id": chat_id, "user_id": pair[1]},
+                ])
+                .on_conflict_do_nothing()
+            )
+        if commit:
+            await self.db.commit()
+            chat_pair_cache[pair] = chat_id
+        return chat_id
+
+
+    async def send_message(self, sender_id: int, receiver_id: int, message: str, read: bool, writer=None):
+        """
+        Store one message without touching the chat history.
+
+        Returns the (id, chat_id, created_at) row generated by a single
+        INSERT ... RETURNING, or by the batch of the write-behind writer
+        when one is given.
+        """
+        pair = (min(sender_id, receiver_id), max(sender_id, receiver_id))
+
+        for attempt in range(2):
+            chat_id = await self.get_or_create_chat(sender_id, receiver_id)
+            try:
+                if writer is not None:
+                    return await writer.submit(chat_id, sender_id, message, read)
+
+                result = await self.db.execute(self._send_statement(chat_id, sender_id, message, read))
+                row = result.one()
+                await self.db.commit()
+                return row
+            except IntegrityError:
+                # The cached chat was deleted meanwhile, resolve it once more
+                await self.db.rollback()
+                forget_chat(chat_id, pair)
+                if attempt:
+                    raise
+
+
+    async def send_messages(self, messages: list[dict]):
+        """
+        Store several messages in one transaction.
+
+        Each of messages has sender_id, receiver_id, message and read. One
+        multi-row INSERT ... RETURNING stores them all, then the summaries of
+        the chats they went to are moved in the same transaction. Chats of
+        first messages are created in it too, so the batch is one commit.
+        Returns the (id, chat_id, created_at) rows in the order of messages.
+        """
+        pairs = [(min(item["sender_id"], item["receiver_id"]), max(item["sender_id"], item["receiver_id"])) for item in messages]
+        # A new chat is created by the first message of its pair
+        first = {}
+        for item, pair in zip(messages, pairs):
+            first.setdefault(pair, (item["sender_id"], item["receiver_id"]))
+
+        for attempt in range(2):
+            # Two batches creating the same chats lock them in the same order
+            chats = {pair: await self.get_or_create_chat(*first[pair], commit=False) for pair in sorted(first)}
+            rows = [
+                {"chat_id": chats[pair], "user_id": item["sender_id"], "message": item["message"], "read": item["read"]}
+                for item, pair in zip(messages, pairs)
+            ]
+            try:
+                result = await self.db.execute(
+                    insert(Message).returning(
+                        Message.id, Message.chat_id, Message.created_at, sort_by_parameter_order=True
+                    ),
+                    rows,
+                )
+                inserted = result.all()
+                await self.update_chat_summaries([row.id for row in inserted])
+                await self.db.commit()
+                chat_pair_cache.update(chats)
+                return inserted
+            except IntegrityError:
+                # A cached chat was deleted meanwhile, resolve them all once more
+                await self.db.rollback()
+                for pair, chat_id in chats.items():
+                    forget_chat(chat_id, pair)
+                if attempt:
+                    raise
+
+
+    @staticmethod
+    def _send_statement(chat_id: int, sender_id: int, message: str, read: bool):
+        """
+        INSERT of the message that also moves the chat summary, in one statement.
+
+        The chat gets the new last_message_id/last_message_at and, unless the
+        message is already read, the unread counter of the other participant
+        goes up by one.
+        """
+        new_message = (
+            insert(Message)
+            .values(message=message, chat_id=chat_id, user_id=sender_id, read=read)
+            .returning(Message.id, Message.chat_id, Message.created_at)
+            .cte("new_message")
+        )
+        # Concurrent sends may commit out of order, never move the summary backwards
+        is_newer = or_(Chat.last_message_id.is_(None), Chat.last_message_id < new_message.c.id)
+        chat_summary = (
+            update(Chat)
+            .where(Chat.id == new_message.c.chat_id)
+            .values(
+                last_message_id=case((is_newer, new_message.c.id), else_=Chat.last_message_id),
+                last_message_at=case((is_newer, new_message.c.created_at), else_=Chat.last_message_at),
+            )
+            .cte("chat_summary")
+        )
+
+        statement = (
+            select(new_message.c.id, new_message.c.chat_id, new_message.c.created_at)
+            .add_cte(chat_summary)
+        )
+        if not read:
+            unread = (
+                update(chat_users)
+                .where(chat_users.c.chat_id == new_message.c.chat_id, chat_users.c.user_id != sender_id)
+                .values(unread_count=chat_users.c.unread_count + 1)
+                .cte("unread")
+            )
+            statement = statement.add_cte(unread)
+
+        return statement
+
+
+    async def update_chat_summaries(self, message_ids: list[int]):
+        """Chat summary maintenance for messages stored in bulk, in the caller's transaction."""
+        latest = (
+            select(Message.chat_id, Message.id, Message.created_at)
+            .filter(Message.id.in_(message_ids))
+            .distinct(Message.chat_id)
+            .order_by(Message.chat_id, Message.id.desc())
+            .subquery()
+        )
+        await self.db.execute(
+            update(Chat)
+            .where(
+                Chat.id == latest.c.chat_id,
+                or_(Chat.last_message_id.is_(None), Chat.last_message_id < latest.c.id),
+            )
+            .values(last_message_id=latest.c.id, last_message_at=latest.c.created_at)
+        )
+
+        unread = (
+            select(Message.chat_id, Message.user_id, func.count().label("count"))
+            .filter(Message.id.in_(message_ids), Message.read.is_(False))
+            .group_by(Message.chat_id, Message.user_id)
+            .subquery()
+        )
+        await self.db.execute(
+            update(chat_users)
+            .where(chat_users.c.chat_id == unread.c.chat_id, chat_users.c.user_id != unread.c.user_id)
+            .values(unread_count=chat_users.c.unread_count + unread.c.count)
+        )
+
+
+    async def repair_chat_summaries(self, first_chat_id: int, last_chat_id: int) -> int:
+        """
+        Recompute the summaries of chats first_chat_id..last_chat_id from the message table.
+
+        Fixes drift left by failed writes or manual edits. Returns the number
+        of chat_users rows whose unread counter was wrong.
+        """
+        latest = (
+            select(Message.chat_id, Message.id, Message.created_at)
+            .filter(Message.chat_id.between(first_chat_id, last_chat_id))
+            .distinct(Message.chat_id)
+            .order_by(Message.chat_id, Message.id.desc())
+            .subquery()
+        )
+        await self.db.execute(
+            update(Chat)
+            .where(Chat.id == latest.c.chat_id, Chat.last_message_id.is_distinct_from(latest.c.id))
+            .values(last_message_id=latest.c.id, last_message_at=latest.c.created_at)
+        )
+
+        unread_count = (
+            select(func.count())
+            .filter(
+                Message.chat_id == chat_users.c.chat_id,
+                Message.user_id != chat_users.c.user_id,
+                Message.id > func.coalesce(chat_users.c.last_read_message_id, 0),
+                Message.read.is_(False),
+            )
+            .scalar_subquery()
+        )
+        result = await self.db.execute(
+            update(chat_users)
+            .where(
+                chat_users.c.chat_id.between(first_chat_id, last_chat_id),
+                chat_users.c.unread_count != unread_count,
+            )
+            .values(unread_count=unread_count)
+        )
+        await self.db.commit()
+        return result.rowcount
+
+
+    async def mark_read(self, chat_id: int, user_id: int, message_id: int) -> int | None:
+        """
+        Move the read watermark of user_id in the chat up to message_id.
+
+        A single-row update of chat_users that also recounts the unread
+        messages left above the new watermark, a short index range scan.
+        Returns the new watermark, or None when it did not move.
+        """
+        last_message_id = select(Chat.last_message_id).filter(Chat.id == chat_id).scalar_subquery()
+        watermark = func.least(message_id, last_message_id)
+        unread_count = (
+            select(func.count())
+            .filter(
+                Message.chat_id == chat_id,
+                Message.user_id != user_id,
+                Message.id > watermark,
+                Message.read.is_(False),
+            )
+            .scalar_subquery()
+        )
+        result = await self.db.execute(
+            update(chat_users)
+            .where(
+                chat_users.c.chat_id == chat_id,
+                chat_users.c.user_id == user_id,
+                func.coalesce(chat_users.c.last_read_message_id, 0) < watermark,
+            )
+            .values(last_read_message_id=watermark, unread_count=unread_count)
+            .returning(chat_users.c.last_read_message_id)
+        )
+        last_read = result.scalar_one_or_none()
+        await self.db.commit()
+        return last_read
+
+
+    async def read_watermarks(self, chat_id: int) -> dict[int, int]:
+        """user id -> last read message id of every participant of the chat."""
+        result = await self.db.execute(
+            select(chat_users.c.user_id, chat_users.c.last_read_message_id)
+            .filter(chat_users.c.chat_id == chat_id)
+        )
+        return {user_id: last_read or 0 for user_id, last_read in result.all()}
+
+
+    async def chat_participants(self, chat_id: int) -> list[int]:
+
+        participants = participants_cache.get(chat_id)
+        if participants is None:
+            result = await self.db.execute(
+                select(chat_users.c.user_id).filter(chat_users.c.chat_id == chat_id)
+            )
+            participants = list(result.scalars().all())
+            if participants:
+                participants_cache[chat_id] = participants
+
+        return participants
+    
+
+    async def latest_messages(self, chat_ids: list[int], per_chat: int) -> dict[int, list[Message]]:
+        """
+        Up to per_chat newest messages of each chat, newest first.
+
+        One query for the whole page of chats, a LATERAL subquery reads only
+        the top of each chat's (chat_id, id DESC) index.
+        """
+        messages = {chat_id: [] for chat_id in chat_ids}
+        if not chat_ids or per_chat <= 0:
+            return messages
+
+        recent = aliased(Message)
+        top = (
+            select(recent.id)
+            .filter(recent.chat_id == Chat.id)
+            .order_by(recent.id.desc())
+            .limit(per_chat)
+            .lateral()
+        )
+        result = await self.db.execute(
+            select(Message)
+            .select_from(Chat)
+            .join(top, true())
+            .join(Message, Message.id == top.c.id)
+            .filter(Chat.id.in_(chat_ids))
+            .order_by(Message.chat_id, Message.id.desc())
+        )
+        for message in result.scalars():
+            messages[message.chat_id].append(message)
+        return messages
+
+
+    async def inbox(self, user_id: int, limit: int, before_id: int | None = None, peer_id: int | None = None):
+        """
+        Chats of user_id with their last message and unread count, most recent first.
+
+        Rows are (chat, last message, unread count, own watermark, peer
+        watermark). Reads the summary kept on chat and chat_users by the send path, so the
+        cost depends on the number of chats, not on the number of messages.
+        before_id is the last message id of the previous page, peer_id
+        narrows the result to the chat with that user.
+        """
+        peer = chat_users.alias("peer")
+        peer_last_read = (
+            select(func.max(peer.c.last_read_message_id))
+            .filter(peer.c.chat_id == Chat.id, peer.c.user_id != user_id)
+            .scalar_subquery()
+        )
+        query = (
+            select(
+                Chat,
+                Message,
+                chat_users.c.unread_count,
+                chat_users.c.last_read_message_id,
+                peer_last_read,
+            )
+            .join(chat_users, chat_users.c.chat_id == Chat.id)
+            .join(Message, Message.id == Chat.last_message_id)
+            .filter(chat_users.c.user_id == user_id)
+        )
+        if peer_id is not None:
+            query = query.filter(
+                Chat.user_low_id == min(user_id, peer_id),
+                Chat.user_high_id == max(user_id, peer_id),
+            )
+        if before_id is not None:
+            query = query.filter(Chat.last_message_id < before_id)
+
+        result = await self.db.execute(query.order_by(Chat.last_message_id.desc()).limit(limit))
+        return result.all()
+    
+
     async def get(self, id: int, model, name):
 
         result = await self.db.execute(select(model).filter(model.id == id))
@@ -77,6 +474,9 @@ class OrmService:
 
         await self.db.commit()  
         await self.db.refresh(obj)
+        if model is User:
+            # is_admin and the profile are served from the identity cache
+            forget_user(obj.id)
         return obj
     
 
@@ -88,6 +488,11 @@ class OrmService:
         if obj is None:
             raise HTTPException(status_code=404, detail=f"No {name}")
         
+        if model is Chat:
+            forget_chat(obj.id, (obj.user_low_id, obj.user_high_id))
+        if model is User:
+            forget_user(obj.id)
+
         await self.db.delete(obj)
         await self.db.commit()
         await self.db.flush()
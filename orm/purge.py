@@ -0,0 +1,108 @@
+import asyncio
+import time
+import uuid
+
+from sqlalchemy import delete, func, select
+
+from models.users import Chat
+from orm.orm import forget_chat
+
+
+class ChatPurge:
+    """
+    Background deletion of every chat, a chunk of chats per transaction.
+
+    Each chunk is one DELETE ... RETURNING. The database removes the
+    messages and chat_users rows of those chats through their ON DELETE
+    CASCADE foreign keys. Every chunk uses a short session of its own, so
+    the purge holds a pool connection only while a chunk runs and other
+    requests are served in between.
+    """
+
+    def __init__(self, session_factory, chunk_size: int = 1000):
+        self.session_factory = session_factory
+        self.chunk_size = chunk_size
+        self.id = uuid.uuid4().hex
+        self.status = "pending"
+        self.total = 0
+        self.deleted = 0
+        self.error: str | None = None
+        self.started_at: float | None = None
+        self.finished_at: float | None = None
+        self._task: asyncio.Task | None = None
+
+    @property
+    def running(self) -> bool:
+        return self.status in ("pending", "running")
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def wait(self):
+        if self._task is not None:
+            await self._task
+
+    def progress(self) -> dict:
+        finished_at = self.finished_at or time.time()
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "total": self.total,
+            "deleted": self.deleted,
+            "error": self.error,
+            "elapsed": round(finished_at - self.started_at, 3) if self.started_at else 0,
+        }
+
+    async def _run(self):
+        self.status = "running"
+        self.started_at = time.time()
+        try:
+            async with self.session_factory() as db:
+                self.total = (await db.execute(select(func.count()).select_from(Chat))).scalar_one()
+
+            while await self._delete_chunk():
+                # Let the requests queued behind the purge run
+                await asyncio.sleep(0)
+        except Exception as e:
+            self.status = "failed"
+            self.error = str(e)
+        else:
+            self.status = "done"
+        finally:
+            self.finished_at = time.time()
+
+    async def _delete_chunk(self) -> int:
+        chunk = select(Chat.id).order_by(Chat.id).limit(self.chunk_size).scalar_subquery()
+        async with self.session_factory() as db:
+            result = await db.execute(
+                delete(Chat)
+                .where(Chat.id.in_(chunk))
+                .returning(Chat.id, Chat.user_low_id, Chat.user_high_id)
+                .execution_options(synchronize_session=False)
+            )
+            rows = result.all()
+            await db.commit()
+
+        for chat_id, user_low_id, user_high_id in rows:
+            forget_chat(chat_id, (user_low_id, user_high_id))
+        self.deleted += len(rows)
+        return len(rows)
+
+
+# job id -> purge, the latest ones only
+purges: dict[str, ChatPurge] = {}
+MAX_KEPT_PURGES = 20
+
+
+def start_purge(session_factory, chunk_size: int = 1000) -> ChatPurge:
+    """Start deleting every chat, or return the purge that is already running."""
+    for purge in purges.values():
+        if purge.running:
+            return purge
+
+    purge = ChatPurge(session_factory, chunk_size)
+    purges[purge.id] = purge
+    while len(purges) > MAX_KEPT_PURGES:
+        del purges[next(iter(purges))]
+    purge.start()
+    return purge
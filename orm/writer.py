@@ -0,0 +1,127 @@
+import asyncio
+import os
+import time
+
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+
+from models.users import Message
+from orm.orm import OrmService
+
+
+class MessageWriter:
+    """
+    Write-behind stage that group-commits messages from all sockets.
+
+    submit() queues a message and waits for its row. A background task collects
+    messages for up to max_delay seconds or max_batch messages, whichever
+    comes first. It stores them with one multi-row INSERT ... RETURNING in one
+    transaction and resolves every pending submit with the (id, chat_id,
+    created_at) of its own row.
+    """
+
+    def __init__(self, session_factory, max_batch: int = 100, max_delay: float = 0.005):
+        self.session_factory = session_factory
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        # None is the stop sentinel
+        self.queue: asyncio.Queue[tuple[dict, asyncio.Future] | None] = asyncio.Queue()
+        self.batches = 0
+        self.written = 0
+        self._task: asyncio.Task | None = None
+
+    @classmethod
+    def from_env(cls, session_factory) -> "MessageWriter | None":
+        """MESSAGE_WRITE_BEHIND=1 enables it, MESSAGE_BATCH_SIZE and MESSAGE_BATCH_DELAY_MS bound the batches."""
+        if os.getenv("MESSAGE_WRITE_BEHIND", "0").lower() not in ("1", "true", "yes"):
+            return None
+        return cls(
+            session_factory,
+            max_batch=int(os.getenv("MESSAGE_BATCH_SIZE", 100)),
+            max_delay=float(os.getenv("MESSAGE_BATCH_DELAY_MS", 5)) / 1000,
+        )
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Write whatever is still queued, then stop."""
+        if self._task is None:
+            return
+        await self.queue.put(None)
+        await self._task
+        self._task = None
+
+    async def submit(self, chat_id: int, user_id: int, message: str, read: bool):
+        future = asyncio.get_running_loop().create_future()
+        row = {"chat_id": chat_id, "user_id": user_id, "message": message, "read": read}
+        await self.queue.put((row, future))
+        return await future
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            item = await self.queue.get()
+            if item is None:
+                break
+
+            batch = [item]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self._flush(batch)
+
+    async def _flush(self, batch: list[tuple[dict, asyncio.Future]]):
+        try:
+            rows = await self._insert([row for row, _ in batch])
+        except IntegrityError:
+            # One bad row (e.g. a chat deleted meanwhile) must not fail the others
+            for item in batch:
+                await self._flush_one(*item)
+            return
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), row in zip(batch, rows):
+            if not future.done():
+                future.set_result(row)
+
+    async def _flush_one(self, row: dict, future: asyncio.Future):
+        try:
+            result = (await self._insert([row]))[0]
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+        else:
+            if not future.done():
+                future.set_result(result)
+
+    async def _insert(self, rows: list[dict]):
+        async with self.session_factory() as db:
+            result = await db.execute(
+                insert(Message).returning(
+                    Message.id, Message.chat_id, Message.created_at, sort_by_parameter_order=True
+                ),
+                rows,
+            )
+            inserted = result.all()
+            await OrmService(db).update_chat_summaries([row.id for row in inserted])
+            await db.commit()
+
+        self.batches += 1
+        self.written += len(inserted)
+        return inserted
@@ -1,4 +1,174 @@
-import redis_.redis__ as redis__
+import asyncio
+import logging
 import os
-# from ..app import app
 
+import redis.asyncio as redis
+
+from security.sessions import SessionStore
+from ws.backplane import Backplane, Handler
+
+
+logger = logging.getLogger(__name__)
+
+class RedisBackplane(Backplane):
+    """
+    Backplane over Redis pub/sub.
+
+    Presence is a Redis set of node ids per user. Every node keeps a
+    heartbeat key alive, so users left behind by a crashed node stop counting
+    as online once its heartbeat expires.
+    """
+
+    channel = "chat:fanout"
+    heartbeat_ttl = 30
+    # Seconds between attempts to subscribe again after the connection dropped
+    resubscribe_delay = 1
+
+    def __init__(self, host: str, port: int):
+        super().__init__()
+        self.client = redis.Redis(host=host, port=port, decode_responses=True)
+        self._pubsub = None
+        self._reader: asyncio.Task | None = None
+        self._heartbeat: asyncio.Task | None = None
+        self._local: set[int] = set()
+
+    def _online_key(self, user_id: int) -> str:
+        return f"chat:online:{user_id}"
+
+    def _node_key(self, node_id: str) -> str:
+        return f"chat:node:{node_id}"
+
+    async def start(self, handler: Handler) -> None:
+        await super().start(handler)
+        await self.client.set(self._node_key(self.node_id), 1, ex=self.heartbeat_ttl)
+        await self._subscribe()
+        self._reader = asyncio.create_task(self._read())
+        self._heartbeat = asyncio.create_task(self._beat())
+
+    async def stop(self) -> None:
+        for task in (self._reader, self._heartbeat):
+            if task is not None:
+                task.cancel()
+        if self._pubsub is not None:
+            await self._pubsub.unsubscribe(self.channel)
+            await self._pubsub.aclose()
+        async with self.client.pipeline() as pipe:
+            for user_id in self._local:
+                pipe.srem(self._online_key(user_id), self.node_id)
+            pipe.delete(self._node_key(self.node_id))
+            await pipe.execute()
+        self._local.clear()
+        await self.client.aclose()
+        await super().stop()
+
+    async def _subscribe(self):
+        self._pubsub = self.client.pubsub()
+        await self._pubsub.subscribe(self.channel)
+
+    async def _read(self):
+        """
+        Dispatch every envelope, resubscribing when the connection drops.
+
+        Envelopes published while the subscription is down are lost, as with
+        any Redis pub/sub subscriber.
+        """
+        while True:
+            try:
+                if self._pubsub is None:
+                    await self._subscribe()
+                    await self._announce()
+                    logger.info("Backplane subscribed again")
+                async for item in self._pubsub.listen():
+                    if item["type"] != "message":
+                        continue
+                    try:
+                        await self._dispatch(item["data"])
+                    except Exception:
+                        logger.exception("Backplane envelope failed")
+                # listen() returns once nothing is subscribed any more
+                logger.warning("Backplane subscription ended")
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Backplane subscription lost")
+
+            pubsub, self._pubsub = self._pubsub, None
+            if pubsub is not None:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+            await asyncio.sleep(self.resubscribe_delay)
+
+    async def _announce(self):
+        """Presence of this node's users again, Redis may have restarted without it."""
+        async with self.client.pipeline() as pipe:
+            pipe.set(self._node_key(self.node_id), 1, ex=self.heartbeat_ttl)
+            for user_id in self._local:
+                pipe.sadd(self._online_key(user_id), self.node_id)
+            await pipe.execute()
+
+    async def _beat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_ttl / 3)
+            try:
+                await self.client.set(self._node_key(self.node_id), 1, ex=self.heartbeat_ttl)
+            except Exception:
+                # The next beat retries, users only go offline after heartbeat_ttl
+                logger.exception("Backplane heartbeat failed")
+
+    async def publish(self, envelope: dict) -> None:
+        await self.client.publish(self.channel, self._encode(envelope))
+
+    async def user_online(self, user_id: int) -> None:
+        self._local.add(user_id)
+        await self.client.sadd(self._online_key(user_id), self.node_id)
+
+    async def user_offline(self, user_id: int) -> None:
+        self._local.discard(user_id)
+        await self.client.srem(self._online_key(user_id), self.node_id)
+
+    async def is_online(self, user_id: int) -> bool:
+        if user_id in self._local:
+            return True
+        nodes = await self.client.smembers(self._online_key(user_id))
+        if not nodes:
+            return False
+        return await self.client.exists(*[self._node_key(node) for node in nodes]) > 0
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Sessions as Redis keys expiring with their TTL, shared by every worker.
+
+    Rotation uses GETDEL, so two concurrent refreshes with the same token
+    cannot both succeed.
+    """
+
+    def __init__(self, host: str, port: int, ttl: float):
+        super().__init__(ttl)
+        self.client = redis.Redis(host=host, port=port, decode_responses=True)
+
+    def _session_key(self, session_id: str) -> str:
+        return f"chat:session:{session_id}"
+
+    async def create(self, user_id: int) -> str:
+        session_id = self.new_id()
+        await self.client.set(self._session_key(session_id), user_id, ex=int(self.ttl))
+        return session_id
+
+    async def get(self, session_id: str) -> int | None:
+        user_id = await self.client.get(self._session_key(session_id))
+        return int(user_id) if user_id is not None else None
+
+    async def rotate(self, session_id: str) -> tuple[int, str] | None:
+        user_id = await self.client.getdel(self._session_key(session_id))
+        if user_id is None:
+            return None
+        return int(user_id), await self.create(int(user_id))
+
+    async def revoke(self, session_id: str) -> None:
+        await self.client.delete(self._session_key(session_id))
+
+    async def close(self) -> None:
+        await self.client.aclose()
@@ -1,6 +1,7 @@
 from fastapi import APIRouter, status, Depends, Response, HTTPException
 from fastapi.security.oauth2 import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from cachetools import TTLCache
+import logging
 
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError
@@ -10,11 +11,13 @@ from db.db import get_db
 from models.users import User
 from schemas.auth import NewAccessTokenResponse, TokenResponse, UserCreateForm, ChangePasswordForm
 from schemas.users import UserBase
-from security.security import get_current_user_with_cookies, get_new_access_token, get_password_hash, oauth2_scheme, get_current_user
+from security.security import forget_user, get_token_payload, get_current_user_with_cookies, get_new_access_token, get_password_hash, oauth2_scheme, get_current_user
 from orm.orm import OrmService
+from security.sessions import session_store
 
 
 router = APIRouter(tags=["Auth"], prefix="/auth")
+logger = logging.getLogger(__name__)
 
 # In-memory cache with a max size of 1 and TTL of 10 minutes (600 seconds)
 cache = TTLCache(maxsize=1, ttl=600)
@@ -24,8 +27,8 @@ async def sign_up(
         user_form: UserCreateForm, # = Depends(UserCreateForm), 
         db: AsyncSession = Depends(get_db)
     ):
-    print('user_form', user_form)
-    hashed_password = get_password_hash(user_form.password)
+    logger.info("Sign up", extra={"username": user_form.username})
+    hashed_password = await get_password_hash(user_form.password)
     user_data = user_form.dict() 
     user_data['password'] = hashed_password
 
@@ -81,13 +84,20 @@ async def logout(
         response: Response,
         db: AsyncSession = Depends(get_db), 
         # current_user: UserBase = Depends(get_current_user_with_cookies),
+        token: str = Depends(oauth2_scheme),
         current_user: UserBase = Depends(get_current_user)
     ):
-    
-    current_user.is_active = False
-    current_user.access_token = None
-    await db.commit() 
-    await db.refresh(current_user)
+
+    payload = await get_token_payload(token)
+    if payload.get('sid') is not None:
+        await session_store.revoke(payload['sid'])
+
+    if current_user.is_active:
+        __orm = OrmService(db)
+        user = await __orm.get(id=current_user.id, model=User, name='logout')
+        user.is_active = False
+        await db.commit()
+    forget_user(current_user.id, token)
     return {
             'message': 'User has been loged out',
             'user_message': 'Poprawne wylogowanie'
@@ -104,12 +114,14 @@ async def chanage_password(
         # current_user: UserBase = Depends(get_current_user_with_cookies),
     ):
 
-    hashed_password = get_password_hash(user_form.new_password)
-    user = current_user #await get_current_user(token=token, db=db)
+    hashed_password = await get_password_hash(user_form.new_password)
+    __orm = OrmService(db)
+    user = await __orm.get(id=current_user.id, model=User, name='chanage_password')
 
     if user_form.old_password != user.password:
         user.password = hashed_password
         await db.commit()
+        forget_user(current_user.id)
 
         return {
             'message': 'The password has been changed',
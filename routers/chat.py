@@ -1,6 +1,8 @@
 import json
-from typing import Annotated
-from fastapi import APIRouter, status, Depends, Response, WebSocket, WebSocketDisconnect, Query, WebSocketException, Cookie
+import logging
+from typing import Annotated, Optional
+from fastapi import APIRouter, HTTPException, status, Depends, Response, WebSocket, WebSocketDisconnect, Query, WebSocketException, Cookie
+from fastapi.responses import StreamingResponse
 from fastapi.security.oauth2 import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 
 from schemas.users import UserBase
@@ -9,165 +11,283 @@ from sqlalchemy.future import select
 from sqlalchemy.orm import selectinload, joinedload
 from sqlalchemy import func, update, or_
 
-from db.db import get_db
+from db.db import get_db, async_session
 from models.users import Chat, Message, chat_users
 from schemas.auth import TokenResponse, UserCreateForm, UserLoginForm
-from schemas.chat import ChatBase, MessageBase
+from schemas.chat import ChatBase, ChatListPage, ChatPage, InboxPage, MessageBase
 from security.security import get_current_user_with_cookies, get_password_hash, oauth2_scheme, get_current_user
 from orm.orm import OrmService
+from orm.purge import purges, start_purge
+from ws.receipts import receipts
 
 
 router = APIRouter(tags=["Chat"], prefix="/chat")
+logger = logging.getLogger(__name__)
 
 
-@router.get("/all_chats", status_code=status.HTTP_200_OK, response_model=list[ChatBase])
+@router.get("/all_chats", status_code=status.HTTP_200_OK, response_model=ChatListPage)
 async def all_chats(
+    limit: int = Query(100, ge=1, le=1000),
+    after_id: Optional[int] = None,
+    messages: int = Query(0, ge=0, le=100),
+    stream: bool = False,
     db: AsyncSession = Depends(get_db),
     # current_user: UserBase = Depends(get_current_user),
     # current_user: UserBase = Depends(get_current_user_with_cookies),
 ):
-    result = await db.execute(
-        select(Chat).options(selectinload(Chat.messages))  # Eagerly load the messages
-    )
-    chat_list = result.scalars().all()
+    """
+    Chats by id, a page at a time, each with at most `messages` latest messages.
+
+    Pass next_cursor as after_id to get the next page. With stream=true every
+    chat after after_id is sent as NDJSON, one chat per line, read through a
+    server-side cursor so memory stays flat whatever the table size.
+    """
+    if stream:
+        return StreamingResponse(
+            stream_chats(after_id, messages), media_type="application/x-ndjson"
+        )
 
-    return [chat.model_dump() for chat in [ChatBase.from_orm(chat) for chat in chat_list]]
+    query = select(Chat, chat_unread_count()).order_by(Chat.id).limit(limit + 1)
+    if after_id is not None:
+        query = query.filter(Chat.id > after_id)
+    result = await db.execute(query)
+    rows = list(result.all())
 
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = rows[-1].Chat.id
 
-@router.get("/get_chat", status_code=status.HTTP_200_OK, response_model=list[ChatBase])
-async def get_chat(
-    sender_id: int,
-    receiver_id: int,
-    count: int,
-    db: AsyncSession = Depends(get_db)
-):
     __orm = OrmService(db)
+    latest = await __orm.latest_messages([chat.id for chat, _ in rows], messages)
 
-    # Make message read=True by receiver
-    await db.execute(
-        update(Message)
-        .where(Message.user_id == receiver_id)
-        .values(read = True)
+    return ChatListPage(
+        chats=[list_chat(chat, latest[chat.id], unread_count) for chat, unread_count in rows],
+        next_cursor=next_cursor,
     )
-    await db.commit()
 
-    # Get chat conversation
-    result = await db.execute(
-    select(Chat)
-    .filter(
-        or_(
-            (Chat.sender_id == sender_id) & (Chat.receiver_id == receiver_id),
-            (Chat.sender_id == receiver_id) & (Chat.receiver_id == sender_id)
-        )
-    )
-    .options(selectinload(Chat.messages))
-)
-    chat_list = result.scalars().all()
 
-    for chat in chat_list:
-        # print('##################### CHAT ID ####################', chat.id, count)
-        if chat.messages:
-            chat.messages = sorted(chat.messages, key=lambda msg: msg.id, reverse=True)[:count]  # Get last 100 messages
+# Chats fetched per round trip of the server-side cursor
+STREAM_BATCH_SIZE = 1000
 
-    return [ChatBase.from_orm(chat) for chat in chat_list]
+
+async def stream_chats(after_id: int | None, messages: int):
+    # The request session is closed before the body is sent, the stream has its own
+    async with async_session() as db:
+        __orm = OrmService(db)
+        query = (
+            select(Chat, chat_unread_count())
+            .order_by(Chat.id)
+            .execution_options(yield_per=STREAM_BATCH_SIZE)
+        )
+        if after_id is not None:
+            query = query.filter(Chat.id > after_id)
+
+        result = await db.stream(query)
+        async for partition in result.partitions():
+            latest = await __orm.latest_messages([chat.id for chat, _ in partition], messages)
+            yield "".join(
+                list_chat(chat, latest[chat.id], unread_count).model_dump_json() + "\n"
+                for chat, unread_count in partition
+            )
+
+
+def chat_unread_count():
+    """Unread messages of a chat over its participants, from the chat_users counters"""
+    return (
+        select(func.coalesce(func.sum(chat_users.c.unread_count), 0))
+        .where(chat_users.c.chat_id == Chat.id)
+        .scalar_subquery()
+    )
 
 
+def list_chat(chat: Chat, messages: list[Message], unread_count: int) -> ChatBase:
+    return ChatBase(
+        id=chat.id,
+        sender_id=chat.sender_id,
+        receiver_id=chat.receiver_id,
+        messages=[MessageBase.from_orm(message) for message in messages],
+        unread_count=unread_count,
+    )
 
 
-# The last message of the chat
-@router.get("/get_last_mess", status_code=status.HTTP_200_OK, response_model=list[ChatBase])
+@router.get("/get_chat", status_code=status.HTTP_200_OK, response_model=list[ChatPage])
 async def get_chat(
     sender_id: int,
     receiver_id: int,
+    count: Optional[int] = Query(None, ge=1, le=500, deprecated=True),
+    limit: int = Query(50, ge=1, le=500),
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
     db: AsyncSession = Depends(get_db)
 ):
+    """
+    One page of the conversation, newest message first.
+
+    Without a cursor the latest messages are returned. Pass next_cursor as
+    before_id to scroll back, or the newest known id as after_id to fetch
+    what arrived since.
+    """
+    limit = count or limit
 
     result = await db.execute(
-    select(Chat)
-    .filter(
-        or_(
-            (Chat.sender_id == sender_id) & (Chat.receiver_id == receiver_id),
-            (Chat.sender_id == receiver_id) & (Chat.receiver_id == sender_id)
+        select(Chat).filter(
+            Chat.user_low_id == min(sender_id, receiver_id),
+            Chat.user_high_id == max(sender_id, receiver_id),
         )
     )
-    .options(selectinload(Chat.messages))  # Eagerly load 'messages'
-)
-    chat_list = result.scalars().all()
+    chat = result.scalar_one_or_none()
+    if chat is None:
+        return []
+
+    # One extra row tells whether there is a next page
+    query = select(Message).filter(Message.chat_id == chat.id)
+    if after_id is not None:
+        query = query.filter(Message.id > after_id).order_by(Message.id.asc())
+    else:
+        if before_id is not None:
+            query = query.filter(Message.id < before_id)
+        query = query.order_by(Message.id.desc())
+
+    result = await db.execute(query.limit(limit + 1))
+    messages = list(result.scalars().all())
+
+    next_cursor = None
+    if len(messages) > limit:
+        messages = messages[:limit]
+        next_cursor = messages[-1].id
+    if after_id is not None:
+        messages.reverse()
+
+    # Opening the latest messages marks the chat read up to the newest one
+    if messages and before_id is None:
+        await mark_chat_read(db, chat.id, sender_id, max(message.id for message in messages))
+
+    __orm = OrmService(db)
+    watermarks = await __orm.read_watermarks(chat.id)
+
+    return [
+        ChatPage(
+            id=chat.id,
+            sender_id=chat.sender_id,
+            receiver_id=chat.receiver_id,
+            messages=[read_message(message, watermarks) for message in messages],
+            unread_count=0,
+            next_cursor=next_cursor,
+        )
+    ]
+
 
-    # Extract the last message for each chat
-    for chat in chat_list:
-        if chat.messages:
-            chat.messages = sorted(chat.messages, key=lambda msg: msg.id, reverse=True)[:1]
-            chat.unread_count = 0
-            for message in chat.messages:
-                if message.read == False:
-                    chat.unread_count += 1
-        else:
-            chat.messages = []
-            chat.unread_count = 0
-            chat.read = False
 
 
-    # print(' ############## UNREAD COUNT ############## ', chat.unread_count)
+@router.post("/mark_read", status_code=status.HTTP_200_OK)
+async def mark_read(
+    chat_id: int,
+    message_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user: UserBase = Depends(get_current_user),
+):
+    """Mark the chat read by the current user up to message_id."""
+    last_read = await mark_chat_read(db, chat_id, current_user.id, message_id)
+    return {"chat_id": chat_id, "last_read_message_id": last_read}
 
 
-    return [ChatBase.from_orm(chat) for chat in chat_list]
+async def mark_chat_read(db: AsyncSession, chat_id: int, reader_id: int, message_id: int) -> int | None:
+    """Move the reader's watermark and tell the other participants, returns the new watermark"""
+    __orm = OrmService(db)
+    last_read = await __orm.mark_read(chat_id, reader_id, message_id)
+    if last_read is not None:
+        participants = await __orm.chat_participants(chat_id)
+        receipts.push(chat_id, reader_id, last_read, [uid for uid in participants if uid != reader_id])
+    return last_read
 
 
+def read_message(message: Message, watermarks: dict[int, int]) -> MessageBase:
+    """A message is read once every other participant's watermark has passed it"""
+    others = [last_read for user_id, last_read in watermarks.items() if user_id != message.user_id]
+    data = MessageBase.from_orm(message)
+    data.read = message.read or (bool(others) and message.id <= min(others))
+    return data
 
 
-@router.get("/delete_all_chats", status_code=status.HTTP_200_OK)
-async def delete_all_chats(db: AsyncSession = Depends(get_db)):
+@router.get("/inbox", status_code=status.HTTP_200_OK, response_model=InboxPage)
+async def inbox(
+    limit: int = Query(20, ge=1, le=100),
+    before_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_db),
+    current_user: UserBase = Depends(get_current_user),
+):
+    """Every chat of the current user with its last message and unread count, by last activity."""
+    __orm = OrmService(db)
+    rows = await __orm.inbox(user_id=current_user.id, limit=limit + 1, before_id=before_id)
 
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = rows[-1][1].id
+
+    return InboxPage(chats=[inbox_chat(current_user.id, *row) for row in rows], next_cursor=next_cursor)
+
+
+# The last message of the chat
+@router.get("/get_last_mess", status_code=status.HTTP_200_OK, response_model=list[ChatBase])
+async def get_last_mess(
+    sender_id: int,
+    receiver_id: int,
+    db: AsyncSession = Depends(get_db)
+):
     __orm = OrmService(db)
+    rows = await __orm.inbox(user_id=sender_id, limit=1, peer_id=receiver_id)
+
+    return [inbox_chat(sender_id, *row) for row in rows]
+
+
+def inbox_chat(
+    user_id: int,
+    chat: Chat,
+    last_message: Message,
+    unread_count: int,
+    last_read_message_id: int | None,
+    peer_last_read_message_id: int | None,
+) -> ChatBase:
+    # Whoever did not write the last message decides whether it is read
+    watermark = peer_last_read_message_id if last_message.user_id == user_id else last_read_message_id
+    data = MessageBase.from_orm(last_message)
+    data.read = last_message.read or last_message.id <= (watermark or 0)
+    return ChatBase(
+        id=chat.id,
+        sender_id=chat.sender_id,
+        receiver_id=chat.receiver_id,
+        messages=[data],
+        unread_count=unread_count,
+    )
 
-    all_chats = await __orm.all(model=Chat, name='get_all_chats')
-    for chat in all_chats:
-        await __orm.delete(id=chat.id, model=Chat, name='delete_single_chat')
 
-    return {
-        'message': 'All chats has been deleted'
-    }
 
 
+@router.get("/delete_all_chats", status_code=status.HTTP_202_ACCEPTED)
+async def delete_all_chats(chunk_size: int = Query(1000, ge=1, le=50_000)):
+    """
+    Start deleting every chat in the background, chunk_size chats per transaction.
 
-class ConnectionManager:
-    def __init__(self):
-        # Ensure this is a dictionary, not a list
-        self.active_connections: dict[int, WebSocket] = {}
+    Returns the job to poll at /chat/delete_all_chats/{job_id}. While a purge
+    runs, calling this again returns that purge instead of starting another.
+    """
+    purge = start_purge(async_session, chunk_size)
 
-    async def connect(self, websocket: WebSocket, chat_id: int):
-        await websocket.accept()
-        self.active_connections[chat_id] = websocket
-        print('************* WEBSOCCET IS CONNECTED ***************')
-
-    async def disconnect(self, websocket: WebSocket):
-        user_id = next((uid for uid, ws in self.active_connections.items() if ws == websocket), None)
-        if user_id:
-            del self.active_connections[user_id]
-
-    async def is_user_online(self, user_id: str) -> bool:
-        return user_id in self.active_connections
-
-    async def send_personal_message(self, message: str, websocket: WebSocket):
-        if message.startswith == 'chat_onopen':
-            await websocket.send_text(message)
-        if message.startswith == 'chat_onclose':
-            await websocket.send_text(message)
-        else:
-            await websocket.send_text(message)
-
-    async def broadcast(self, message: str):
-        for connection in self.active_connections.values():
-            await connection.send_text(message)
-
-    def get_connection(self, user_id: int) -> WebSocket | None:
-        return self.active_connections.get(user_id)
-    
+    return {
+        'message': 'Deleting all chats',
+        **purge.progress(),
+    }
 
 
-manager = ConnectionManager()
+@router.get("/delete_all_chats/{job_id}", status_code=status.HTTP_200_OK)
+async def delete_all_chats_progress(job_id: str):
+    purge = purges.get(job_id)
+    if purge is None:
+        raise HTTPException(status_code=404, detail="No purge")
 
+    return purge.progress()
 
 
 @router.websocket("/ws/{client_id}/{sender_id}")
@@ -188,12 +308,11 @@ async def websocket_endpoint(
         current_user = get_current_user_with_cookies(token)
 
         if not current_user:
-            print(' *********** no current_user *********** ')
+            logger.info("Websocket without current user")
         #     await websocket.close(code=1008)  # Policy violation or unauthorized
         #     return
         await websocket.accept()
 
-        print(' *********** current_user *********** ', current_user, token)
     
 
     # Validate token and authenticate user
@@ -0,0 +1,12 @@
+from fastapi import APIRouter, status
+
+from db.db import pool_stats
+
+
+router = APIRouter(tags=["System"], prefix="/system")
+
+
+@router.get("/pool", status_code=status.HTTP_200_OK)
+async def pool():
+    """Database pool of this worker: size, checked out, overflow and checkout wait time."""
+    return pool_stats()
@@ -22,7 +22,8 @@ class TokenResponse(BaseModel):
 
 class NewAccessTokenResponse(BaseModel):
     access_token: str
-    # refresh_token: str
+    # Replaces the refresh token that was used, which no longer works
+    refresh_token: Optional[str] = None
 
 
 class ChangePasswordForm(BaseModel):
@@ -22,4 +22,22 @@ class ChatBase(BaseModel):
 
     class Config:
         from_attributes = True
-    
\ No newline at end of file
+
+
+class ChatPage(ChatBase):
+    # Pass as before_id (or after_id when paging forward) to get the next page
+    next_cursor: Optional[int] = None
+
+
+class InboxPage(BaseModel):
+    # Every chat carries only its last message
+    chats: list[ChatBase]
+    # Pass as before_id to get the next page
+    next_cursor: Optional[int] = None
+
+
+class ChatListPage(BaseModel):
+    # Every chat carries at most the requested number of latest messages
+    chats: list[ChatBase]
+    # Pass as after_id to get the next page
+    next_cursor: Optional[int] = None
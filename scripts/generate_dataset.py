@@ -0,0 +1,328 @@
+"""
+Generate synthetic users, chats and messages and bulk load them with COPY.
+
+Chat sizes follow a power law (a few chats hold most of the messages),
+users start chats with a power-law skew too, messages come in bursts
+spread over --days and some chats end with unread messages. Chat summaries
+and chat_users rows (unread counters, read watermarks) are computed while
+generating, so the data is consistent without a repair pass.
+
+Rows go in through asyncpg's binary COPY, a transaction per --batch
+messages. The same --seed and --end (a fixed date by default) always give
+the same rows. Ids are taken from the tables' sequences, so the data can be
+added next to existing rows, but then they depend on what the sequences
+handed out before. With --id-start the ids of every table are numbered from
+that value instead and the run is fully reproducible. It fails if any of
+those ids is taken, and the sequences are moved past them.
+
+    python -m scripts.generate_dataset --users 10000 --messages 1000000 --seed 1
+    python -m scripts.generate_dataset --users 100 --chats 300 --messages 5000 --prefix demo_
+    python -m scripts.generate_dataset --seed 1 --end 2025-06-30 --id-start 1000000
+"""
+import argparse
+import asyncio
+import bisect
+import itertools
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db.db import async_session, async_engine
+from security.security import get_password_hash
+
+
+# Newest timestamp of a dataset unless --end says otherwise, fixed so a seed replays
+DEFAULT_END = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+WORDS = (
+    "hi hello hey ok okay sure yes no maybe thanks see you later tomorrow today tonight "
+    "what when where why how lunch dinner call meeting work home soon now busy free "
+    "great cool nice sorry sounds good let me know on my way running late just got here"
+).split()
+
+
+def power_law_weights(count: int, alpha: float) -> list[float]:
+    """Weight of rank 1..count, proportional to 1 / rank ** alpha."""
+    return [1 / rank ** alpha for rank in range(1, count + 1)]
+
+
+def chat_sizes(rng: random.Random, chats: int, messages: int, alpha: float) -> list[int]:
+    """Split messages over chats by power-law rank, the first chat is the largest."""
+    weights = power_law_weights(chats, alpha)
+    total = sum(weights)
+    sizes = [int(messages * weight / total) for weight in weights]
+    # Rounding leftovers go to random chats, weighted the same way
+    cum_weights = list(itertools.accumulate(weights))
+    for _ in range(messages - sum(sizes)):
+        sizes[bisect.bisect(cum_weights, rng.random() * total)] += 1
+    return sizes
+
+
+def chat_pairs(rng: random.Random, users: int, chats: int, alpha: float) -> list[tuple[int, int]]:
+    """Distinct (starter, other) user index pairs; starters are power-law skewed."""
+    if chats > users * (users - 1) // 2:
+        raise ValueError(f"{users} users can have at most {users * (users - 1) // 2} chats")
+    cum_weights = list(itertools.accumulate(power_law_weights(users, alpha)))
+    total = cum_weights[-1]
+    seen, pairs = set(), []
+    while len(pairs) < chats:
+        starter = min(bisect.bisect(cum_weights, rng.random() * total), users - 1)
+        other = rng.randrange(users)
+        key = (min(starter, other), max(starter, other))
+        if starter == other or key in seen:
+            continue
+        seen.add(key)
+        pairs.append((starter, other))
+    return pairs
+
+
+def conversation(
+    rng: random.Random, size: int, end: datetime, days: float, unread: float
+) -> tuple[list[datetime], list[int], int]:
+    """
+    Timestamps, authors (0 starter, 1 other) and the number of trailing
+    unread messages of one chat.
+
+    Messages come in bursts: mostly seconds apart, with hours between
+    sessions. The chat starts at a random point of the last days and is
+    squeezed to end before end.
+    """
+    if size == 0:
+        return [], [], 0
+    span = rng.random() * days * 86400
+    gaps = [
+        rng.expovariate(1 / 30) if rng.random() < 0.9 else rng.expovariate(1 / 21600)
+        for _ in range(size)
+    ]
+    offsets = list(itertools.accumulate(gaps))
+    scale = min(1.0, span / offsets[-1]) if offsets[-1] else 1.0
+    start = end - timedelta(seconds=span)
+    timestamps = [start + timedelta(seconds=offset * scale) for offset in offsets]
+
+    authors, author = [], 0
+    for _ in range(size):
+        authors.append(author)
+        # Replies alternate, with runs of several messages by the same person
+        if rng.random() < 0.6:
+            author = 1 - author
+
+    unread_tail = 0
+    if rng.random() < unread:
+        last_author = authors[-1]
+        limit = 1 + int(rng.expovariate(1 / 3))
+        for message_author in reversed(authors):
+            if message_author != last_author or unread_tail == limit:
+                break
+            unread_tail += 1
+    return timestamps, authors, unread_tail
+
+
+async def reserve_ids(db: AsyncSession, table: str, count: int) -> list[int]:
+    """count ids from the table's sequence, safe next to concurrent inserts."""
+    if count == 0:
+        return []
+    result = await db.execute(
+        text("SELECT nextval(pg_get_serial_sequence(:table, 'id')) FROM generate_series(1, CAST(:count AS integer))"),
+        {"table": table, "count": count},
+    )
+    return sorted(result.scalars().all())
+
+
+async def check_free_ids(db: AsyncSession, table: str, start: int, count: int):
+    taken = await db.scalar(
+        text(f"SELECT EXISTS (SELECT 1 FROM {table} WHERE id BETWEEN :start AND :end)"),
+        {"start": start, "end": start + count - 1},
+    )
+    if taken:
+        raise ValueError(f"{table} already has ids between {start} and {start + count - 1}")
+
+
+async def advance_sequence(db: AsyncSession, table: str):
+    """Move the table's sequence past ids that were not taken from it."""
+    await db.execute(text(f"""
+        SELECT setval(
+            pg_get_serial_sequence('{table}', 'id'),
+            GREATEST((SELECT MAX(id) FROM {table}), nextval(pg_get_serial_sequence('{table}', 'id')))
+        )
+    """))
+
+
+async def copy_records(db: AsyncSession, table: str, columns: tuple[str, ...], records: list[tuple]):
+    """Binary COPY through the asyncpg connection of the session's transaction."""
+    connection = await db.connection()
+    raw = await connection.get_raw_connection()
+    await raw.driver_connection.copy_records_to_table(table, records=records, columns=columns)
+
+
+async def generate(
+    db: AsyncSession,
+    users: int,
+    chats: int,
+    messages: int,
+    seed: int = 0,
+    *,
+    alpha: float = 1.1,
+    unread: float = 0.2,
+    days: float = 365,
+    password_hash: str = "x",
+    prefix: str = "gen_",
+    batch: int = 50_000,
+    end: datetime = DEFAULT_END,
+    id_start: int | None = None,
+) -> dict:
+    """
+    Load a dataset, committing every batch messages.
+
+    Ids come from the sequences, or are numbered from id_start in every
+    table. Returns the user ids, the chat ids from the largest chat down
+    and the row counts.
+    """
+    rng = random.Random(seed)
+
+    next_ids: dict[str, int] = {}
+    if id_start is not None:
+        for table, count in (("users", users), ("chat", chats), ("message", messages)):
+            await check_free_ids(db, table, id_start, count)
+            next_ids[table] = id_start
+
+    async def take_ids(table: str, count: int) -> list[int]:
+        if id_start is None:
+            return await reserve_ids(db, table, count)
+        first = next_ids[table]
+        next_ids[table] = first + count
+        return list(range(first, first + count))
+
+    user_ids = await take_ids("users", users)
+    await copy_records(
+        db, "users", ("id", "username", "email", "password", "created_at"),
+        [
+            (user_id, f"{prefix}{n}", f"{prefix}{n}@example.com", password_hash,
+             end - timedelta(days=days + rng.random() * 30))
+            for n, user_id in enumerate(user_ids, start=1)
+        ],
+    )
+    await db.commit()
+
+    sizes = chat_sizes(rng, chats, messages, alpha)
+    pairs = chat_pairs(rng, users, chats, alpha)
+    chat_ids: list[int] = []
+    written = 0
+
+    pending_chats: list[tuple[tuple[int, int], int]] = []
+    pending_messages = 0
+
+    async def flush():
+        nonlocal written
+        ids = await take_ids("chat", len(pending_chats))
+        message_ids = iter(await take_ids("message", pending_messages))
+        chat_rows, member_rows, message_rows = [], [], []
+
+        for chat_id, ((starter, other), size) in zip(ids, pending_chats):
+            members = (user_ids[starter], user_ids[other])
+            last_read: list[int | None] = [None, None]
+            unread_count = [0, 0]
+            timestamps, authors, unread_tail = conversation(rng, size, end, days, unread)
+            last_id = None
+            for n, (created_at, author) in enumerate(zip(timestamps, authors)):
+                last_id = next(message_ids)
+                reader = 1 - author
+                read = n < size - unread_tail
+                if read:
+                    last_read[reader] = last_id
+                else:
+                    unread_count[reader] += 1
+                words = rng.choices(WORDS, k=1 + int(rng.expovariate(1 / 6)))
+                message_rows.append((last_id, " ".join(words), created_at, chat_id, members[author], read))
+
+            chat_rows.append((
+                chat_id, members[0], members[1], min(members), max(members),
+                last_id, timestamps[-1] if size else None,
+            ))
+            member_rows.extend(
+                (chat_id, members[side], unread_count[side], last_read[side]) for side in (0, 1)
+            )
+            chat_ids.append(chat_id)
+
+        await copy_records(
+            db, "chat",
+            ("id", "sender_id", "receiver_id", "user_low_id", "user_high_id", "last_message_id", "last_message_at"),
+            chat_rows,
+        )
+        await copy_records(db, "chat_users", ("chat_id", "user_id", "unread_count", "last_read_message_id"), member_rows)
+        await copy_records(db, "message", ("id", "message", "created_at", "chat_id", "user_id", "read"), message_rows)
+        await db.commit()
+        written += len(message_rows)
+        pending_chats.clear()
+
+    for pair, size in zip(pairs, sizes):
+        pending_chats.append((pair, size))
+        pending_messages += size
+        if pending_messages >= batch:
+            await flush()
+            pending_messages = 0
+    if pending_chats:
+        await flush()
+
+    if id_start is not None:
+        for table in ("users", "chat", "message"):
+            await advance_sequence(db, table)
+    await db.execute(text("ANALYZE users, chat, chat_users, message"))
+    await db.commit()
+    return {"user_ids": user_ids, "chat_ids": chat_ids, "users": users, "chats": chats, "messages": written}
+
+
+def parse_end(value: str) -> datetime:
+    end = datetime.fromisoformat(value)
+    return end if end.tzinfo is not None else end.replace(tzinfo=timezone.utc)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--chats", type=int, default=None, help="5 per user by default")
+    parser.add_argument("--messages", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--alpha", type=float, default=1.1, help="power-law exponent of chat sizes and starters")
+    parser.add_argument("--unread", type=float, default=0.2, help="share of chats ending with unread messages")
+    parser.add_argument("--days", type=float, default=365, help="how far back the history goes")
+    parser.add_argument("--password", default="password", help="password of every user, hashed once")
+    parser.add_argument("--prefix", default=None, help="username and email prefix, gen{seed}_ by default")
+    parser.add_argument("--batch", type=int, default=50_000, help="messages per transaction")
+    parser.add_argument(
+        "--end", type=parse_end, default=DEFAULT_END,
+        help=f"newest timestamp, ISO 8601 in UTC, {DEFAULT_END.date()} by default",
+    )
+    parser.add_argument("--id-start", type=int, default=None, help="first id of every table, sequences by default")
+    args = parser.parse_args()
+
+    password_hash = await get_password_hash(args.password)
+    started = time.perf_counter()
+    async with async_session() as db:
+        dataset = await generate(
+            db,
+            users=args.users,
+            chats=args.chats if args.chats is not None else args.users * 5,
+            messages=args.messages,
+            seed=args.seed,
+            alpha=args.alpha,
+            unread=args.unread,
+            days=args.days,
+            password_hash=password_hash,
+            prefix=args.prefix if args.prefix is not None else f"gen{args.seed}_",
+            batch=args.batch,
+            end=args.end,
+            id_start=args.id_start,
+        )
+    elapsed = time.perf_counter() - started
+    await async_engine.dispose()
+
+    rows = dataset["users"] + dataset["chats"] * 3 + dataset["messages"]
+    print(f"{dataset['users']} users, {dataset['chats']} chats, {dataset['messages']} messages"
+          f" in {elapsed:.1f}s, {rows / elapsed * 60:,.0f} rows/min")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
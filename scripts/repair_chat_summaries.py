@@ -0,0 +1,38 @@
+"""
+Recompute chat summaries (last message, unread counters) from the message table.
+
+The send path keeps them up to date; this job fixes drift after failed
+writes, manual data edits or restores. It walks the chats in id ranges, one
+short transaction per range, so it can run against a live database.
+
+    python -m scripts.repair_chat_summaries --chunk 1000
+"""
+import argparse
+import asyncio
+
+from sqlalchemy import func, select
+
+from db.db import async_session, async_engine
+from models.users import Chat
+from orm.orm import OrmService
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunk", type=int, default=1000, help="chats per transaction")
+    args = parser.parse_args()
+
+    async with async_session() as db:
+        last_id = (await db.execute(select(func.max(Chat.id)))).scalar() or 0
+
+    repaired = 0
+    for first_id in range(1, last_id + 1, args.chunk):
+        async with async_session() as db:
+            repaired += await OrmService(db).repair_chat_summaries(first_id, first_id + args.chunk - 1)
+        print(f"chats {first_id}..{min(first_id + args.chunk - 1, last_id)} of {last_id}, unread counters fixed: {repaired}")
+
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,104 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+
+class PasswordHasher:
+    """
+    bcrypt off the event loop.
+
+    Hashing and verification run in a small thread pool (bcrypt releases the
+    GIL while it works), so a login burst no longer freezes every socket of
+    the worker. At most max_workers hashes run at once. Once max_pending
+    calls are running or queued, new ones get 503 instead of piling up.
+    """
+
+    def __init__(self, rounds: int = 12, max_workers: int = 4, max_pending: int = 256):
+        self.context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=rounds)
+        self.rounds = rounds
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bcrypt")
+
+        self.pending = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.queue_time_total = 0.0
+        self.queue_time_max = 0.0
+        self.run_time_total = 0.0
+
+    @classmethod
+    def from_env(cls) -> "PasswordHasher":
+        """BCRYPT_ROUNDS sets the cost, BCRYPT_WORKERS and BCRYPT_MAX_PENDING bound the pool."""
+        return cls(
+            rounds=int(os.getenv("BCRYPT_ROUNDS", 12)),
+            max_workers=int(os.getenv("BCRYPT_WORKERS", min(4, os.cpu_count() or 1))),
+            max_pending=int(os.getenv("BCRYPT_MAX_PENDING", 256)),
+        )
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.context.hash, password)
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return await self._run(self.context.verify, password, hashed)
+
+    async def verify_and_update(self, password: str, hashed: str) -> tuple[bool, str | None]:
+        """Like verify, also returns a new hash when hashed was made with another cost."""
+        return await self._run(self.context.verify_and_update, password, hashed)
+
+    async def _run(self, func, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many logins, try again later.",
+                headers={"Retry-After": "1"},
+            )
+
+        submitted = time.perf_counter()
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, self._timed, submitted, func, *args
+            )
+        finally:
+            self.pending -= 1
+
+    def _timed(self, submitted: float, func, *args):
+        # Runs in the pool thread, counters are only approximate under contention
+        started = time.perf_counter()
+        queue_time = started - submitted
+        self.running += 1
+        try:
+            return func(*args)
+        finally:
+            self.running -= 1
+            self.completed += 1
+            self.queue_time_total += queue_time
+            self.queue_time_max = max(self.queue_time_max, queue_time)
+            self.run_time_total += time.perf_counter() - started
+
+    def stats(self) -> dict:
+        completed = self.completed or 1
+        return {
+            "rounds": self.rounds,
+            "workers": self.max_workers,
+            "pending": self.pending,
+            "running": self.running,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "queue_ms_avg": self.queue_time_total / completed * 1e3,
+            "queue_ms_max": self.queue_time_max * 1e3,
+            "hash_ms_avg": self.run_time_total / completed * 1e3,
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+password_hasher = PasswordHasher.from_env()
@@ -1,10 +1,12 @@
 # import datetime
 from datetime import datetime, timedelta, timezone
+import hashlib
+import time
+from cachetools import LRUCache, TTLCache
 from db.db import get_db
 from fastapi import HTTPException, status
 from jose import JWTError, jwt, ExpiredSignatureError
 # from .settings import settings
-from passlib.context import CryptContext
 # from fastapi.security import HTTPBearer
 from fastapi.security.oauth2 import OAuth2PasswordBearer
 from fastapi import Depends, Request
@@ -14,45 +16,68 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
 from schemas.auth import NewAccessTokenResponse, TokenResponse
+from schemas.users import UserBase
+from security.hashing import password_hasher
+from security.sessions import session_store
 
 from dotenv import load_dotenv
+import logging
 import os
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+# bcrypt runs in a bounded thread pool, see PasswordHasher
+pwd_context = password_hasher.context
 # auth_scheme = HTTPBearer()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
+# sha256 of a token -> its verified payload, valid until the token's exp
+token_cache = LRUCache(maxsize=int(os.getenv("AUTH_TOKEN_CACHE_SIZE", 10_000)))
+# user id -> UserBase snapshot. Other workers see changes after at most the TTL.
+user_cache = TTLCache(
+    maxsize=int(os.getenv("AUTH_USER_CACHE_SIZE", 10_000)),
+    ttl=float(os.getenv("AUTH_USER_CACHE_TTL", 60)),
+)
+
+
+def token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def forget_user(user_id: int, token: str | None = None):
+    """Drop a user (and one of their tokens) from the identity caches after a change."""
+    user_cache.pop(user_id, None)
+    if token is not None:
+        token_cache.pop(token_digest(token), None)
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+
+async def get_password_hash(password):
+    return await password_hasher.hash(password)
 
 
 # Verify Hash Password
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password, hashed_password):
+    return await password_hasher.verify(plain_password, hashed_password)
+
+
+# Verify, and rehash when BCRYPT_ROUNDS changed since the hash was made
+async def verify_and_update_password(plain_password, hashed_password) -> tuple[bool, str | None]:
+    return await password_hasher.verify_and_update(plain_password, hashed_password)
 
 
 
 # Create Access & Refresh Token
-async def get_tokens_pair(db, id):
+async def get_tokens_pair(user: User) -> TokenResponse:
+    """Open a session for the user, nothing is written to the users row"""
 
-    payload = {'id': id}
+    session_id = await session_store.create(user.id)
+    payload = {'id': user.id, 'sid': session_id}
     access_token = await create_access_token(payload)
     refresh_token = await create_refresh_token(payload)
 
-    print('***************** access_token *****************', access_token)
-
-    result = await db.execute(select(User).filter(User.id == id))
-    user = result.scalar_one_or_none()
-    user.access_token = access_token
-    user.refresh_token = refresh_token
-    db.add(user)
-    await db.commit()
-    await db.refresh(user)
-
     response = TokenResponse(
         id=user.id,
         username=user.username,
@@ -66,25 +91,44 @@ async def get_tokens_pair(db, id):
 
 
 # Create New Access Token via Refresh Token
-async def get_new_access_token(refresh_token: str):
+async def get_new_access_token(refresh_token: str, rotate: bool = True):
+    """
+    New access token for a live session.
+
+    With rotate the session is replaced and a new refresh token returned,
+    the one passed in stops working.
+    """
+    invalid = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail=f"Invalid refresh token.",
+        headers={"WWW-Authenticate": "Bearer"}
+    )
 
     try:
         payload = jwt.decode(refresh_token, os.getenv("SECRET_KEY"), algorithms=os.getenv("algorithm"))
-        new_access_token =  await create_access_token(payload)
-        # new_refresh_token = await create_refresh_token(payload)
-        response = NewAccessTokenResponse(
-            access_token=new_access_token,
-            # refresh_token=new_refresh_token,
-        )
-
-        return response
-    
     except JWTError:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail=f"Invalid refresh token.",
-            headers={"WWW-Authenticate": "Bearer"}
-        )
+        raise invalid
+
+    session_id = payload.get('sid')
+    if session_id is None:
+        raise invalid
+
+    if not rotate:
+        if await session_store.get(session_id) != payload['id']:
+            raise invalid
+        return NewAccessTokenResponse(access_token=await create_access_token(payload))
+
+    rotated = await session_store.rotate(session_id)
+    if rotated is None or rotated[0] != payload['id']:
+        raise invalid
+
+    payload = {'id': payload['id'], 'sid': rotated[1]}
+    response = NewAccessTokenResponse(
+        access_token=await create_access_token(payload),
+        refresh_token=await create_refresh_token(payload),
+    )
+
+    return response
 
 
 # Create Access Token
@@ -101,7 +145,7 @@ async def create_access_token(data: dict):
 async def create_refresh_token(data: dict):
 
     payload = data.copy()
-    expire = datetime.now(timezone.utc) + timedelta(days=7)
+    expire = datetime.now(timezone.utc) + timedelta(seconds=session_store.ttl)
     payload.update({"exp": expire}) 
 
     return jwt.encode(payload, os.getenv("SECRET_KEY"), os.getenv("algorithm"))
@@ -109,6 +153,11 @@ async def create_refresh_token(data: dict):
 
 # Get Payload Of Token
 async def get_token_payload(token: str) -> dict:
+    digest = token_digest(token)
+    cached = token_cache.get(digest)
+    if cached is not None and cached.get("exp", 0) > time.time():
+        return dict(cached)
+
     try:
         # Decode and enforce expiration
         tkn_pld = jwt.decode(
@@ -117,7 +166,9 @@ async def get_token_payload(token: str) -> dict:
             algorithms=[os.getenv("algorithm")],
             options={"verify_exp": True},  # Ensure "exp" is required
         )
-        return tkn_pld
+        if "exp" in tkn_pld:
+            token_cache[digest] = tkn_pld
+        return dict(tkn_pld)
 
     except ExpiredSignatureError:
         raise HTTPException(
@@ -148,35 +199,40 @@ async def get_token_payload(token: str) -> dict:
     
 
 # token: str = Depends(oauth2_scheme) for Swagger Authorize
-async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db))-> User:
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db))-> UserBase:
+    """
+    The user of the token, served from user_cache when possible.
+
+    Returns a UserBase snapshot, not a session-bound User. Endpoints that
+    change the user load the row themselves and call forget_user.
+    """
     user = await get_token_payload(token)
-    print('***************** user *****************', user)
     user_id = user.get('id')
-    result = await db.execute(select(User).filter(User.id == user_id))
-    print('***************** result *****************', result)
-    current_user = result.scalar_one_or_none()
-    
+
+    current_user = user_cache.get(user_id)
+    if current_user is None:
+        result = await db.execute(select(User).filter(User.id == user_id))
+        db_user = result.scalar_one_or_none()
+        if db_user is None:
+            return None
+        current_user = UserBase.model_validate(db_user, from_attributes=True)
+        user_cache[user_id] = current_user
+
     return current_user
 
 
 async def check_admin(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
 
-    user = await get_token_payload(token)
-    user_id = user.get('id')
-    result = await db.execute(select(User).filter(User.id == user_id))
-    current_user = result.scalar_one_or_none()
-    if current_user.is_admin != True:
+    current_user = await get_current_user(token, db)
+    if current_user is None or current_user.is_admin != True:
         raise HTTPException(status_code=403, detail="Admin role required")
     
 
 async def get_current_user_with_cookies(request: Request, token: str, db: AsyncSession = Depends(get_db)) -> User:
 
-    print('get_current_user_with_cookies token -------------------', token)
     access_token = request.cookies.get("access_token") 
     refresh_token = request.cookies.get("refresh_token")
 
-    print('get_current_user_with_cookies -------------------', access_token)
-
     if access_token is None or refresh_token is None:
         raise HTTPException(status_code=307, detail="Redirecting", headers={"Location": "http://127.0.0.1:8005/auth/login"})
         # return RedirectResponse(url="http://127.0.0.1:8006/login")
@@ -185,24 +241,20 @@ async def get_current_user_with_cookies(request: Request, token: str, db: AsyncS
     try:
         user = await get_token_payload(access_token)
     except:
-        new_access_token = await get_new_access_token(refresh_token)
+        new_access_token = await get_new_access_token(refresh_token, rotate=False)
         user = await get_token_payload(new_access_token)
-        print('user ------------------- after refresh', user)
+        logger.debug("Access token refreshed from cookie", extra={"user_id": user.get("id")})
     user_id = user.get("id")
 
-    print('MAIN PAGE------------------- user', user)
-
     # Query the database for the user
     result = await db.execute(select(User).filter(User.id == user_id))
     current_user = result.scalar_one_or_none()
-    print('refresh_token-------------------', refresh_token)
 
     # Handle the case where the user is not found
     if not current_user:
 
         try:
-            new_access_token = get_new_access_token(refresh_token)
-            print('new_access_token-------------------', new_access_token)
+            new_access_token = get_new_access_token(refresh_token, rotate=False)
             user = await get_token_payload(access_token)
             user_id = user.get("id")
             result = await db.execute(select(User).filter(User.id == user_id))
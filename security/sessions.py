@@ -0,0 +1,190 @@
+import os
+import secrets
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, insert, select
+
+from models.users import UserSession
+
+
+class SessionStore:
+    """
+    Refresh-token sessions, kept out of the users table.
+
+    A session id is the "sid" claim of the refresh token. Refreshing
+    consumes the session and creates a new one (rotation), so each refresh
+    token works once. Logging out removes the session.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+
+    @staticmethod
+    def new_id() -> str:
+        return secrets.token_urlsafe(24)
+
+    async def create(self, user_id: int) -> str:
+        raise NotImplementedError
+
+    async def get(self, session_id: str) -> int | None:
+        """The user of a live session, or None."""
+        raise NotImplementedError
+
+    async def rotate(self, session_id: str) -> tuple[int, str] | None:
+        """Consume a session and create its successor, (user id, new session id)."""
+        raise NotImplementedError
+
+    async def revoke(self, session_id: str) -> None:
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+
+class DatabaseSessionStore(SessionStore):
+    """
+    Sessions as rows of the narrow user_sessions table, shared by every worker.
+
+    A login inserts a row and a refresh swaps one, the users table is not
+    written. Rotation deletes the old row with DELETE ... RETURNING, so two
+    concurrent refreshes with the same token cannot both succeed.
+    """
+
+    # Expired rows deleted by each login, so abandoned sessions do not pile up
+    purge_batch = 100
+
+    def __init__(self, session_factory, ttl: float):
+        super().__init__(ttl)
+        self.session_factory = session_factory
+
+    async def create(self, user_id: int) -> str:
+        async with self.session_factory() as db:
+            session_id = await self._insert(db, user_id)
+            await db.commit()
+        return session_id
+
+    async def get(self, session_id: str) -> int | None:
+        async with self.session_factory() as db:
+            result = await db.execute(
+                select(UserSession.user_id).filter(
+                    UserSession.id == session_id,
+                    UserSession.expires_at > datetime.now(timezone.utc),
+                )
+            )
+            return result.scalar_one_or_none()
+
+    async def rotate(self, session_id: str) -> tuple[int, str] | None:
+        async with self.session_factory() as db:
+            result = await db.execute(
+                delete(UserSession)
+                .filter(UserSession.id == session_id)
+                .returning(UserSession.user_id, UserSession.expires_at)
+            )
+            session = result.one_or_none()
+            if session is None or session.expires_at <= datetime.now(timezone.utc):
+                await db.commit()
+                return None
+            new_session_id = await self._insert(db, session.user_id)
+            await db.commit()
+        return session.user_id, new_session_id
+
+    async def revoke(self, session_id: str) -> None:
+        async with self.session_factory() as db:
+            await db.execute(delete(UserSession).filter(UserSession.id == session_id))
+            await db.commit()
+
+    async def _insert(self, db, user_id: int) -> str:
+        now = datetime.now(timezone.utc)
+        expired = (
+            select(UserSession.id)
+            .filter(UserSession.expires_at <= now)
+            .limit(self.purge_batch)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        await db.execute(delete(UserSession).filter(UserSession.id.in_(expired)))
+
+        session_id = self.new_id()
+        await db.execute(
+            insert(UserSession).values(
+                id=session_id, user_id=user_id, expires_at=now + timedelta(seconds=self.ttl)
+            )
+        )
+        return session_id
+
+
+class InMemorySessionStore(SessionStore):
+    """Single process store, for development and tests: a restart logs everyone out."""
+
+    def __init__(self, ttl: float):
+        super().__init__(ttl)
+        # session id -> (user id, expires at)
+        self.sessions: dict[str, tuple[int, float]] = {}
+        # (expires at, session id) in creation order, which with one ttl is expiry order
+        self.expiries: deque[tuple[float, str]] = deque()
+
+    async def create(self, user_id: int) -> str:
+        now = time.monotonic()
+        self._expire(now)
+        session_id = self.new_id()
+        self.sessions[session_id] = (user_id, now + self.ttl)
+        self.expiries.append((now + self.ttl, session_id))
+        return session_id
+
+    async def get(self, session_id: str) -> int | None:
+        session = self.sessions.get(session_id)
+        if session is None:
+            return None
+        if session[1] <= time.monotonic():
+            del self.sessions[session_id]
+            return None
+        return session[0]
+
+    async def rotate(self, session_id: str) -> tuple[int, str] | None:
+        session = self.sessions.pop(session_id, None)
+        if session is None or session[1] <= time.monotonic():
+            return None
+        return session[0], await self.create(session[0])
+
+    async def revoke(self, session_id: str) -> None:
+        self.sessions.pop(session_id, None)
+
+    def _expire(self, now: float):
+        # Every session is popped once, so logins pay amortized O(1) for it
+        while self.expiries and self.expiries[0][0] <= now:
+            _, session_id = self.expiries.popleft()
+            session = self.sessions.get(session_id)
+            if session is not None and session[1] <= now:
+                del self.sessions[session_id]
+
+
+def session_store_from_env() -> SessionStore:
+    """
+    Pick the store from SESSION_STORE=database|redis|memory (database by default).
+
+    Sessions live REFRESH_TOKEN_TTL seconds. The memory store keeps them in
+    one process only, it is meant for development and tests.
+    """
+    ttl = float(os.getenv("REFRESH_TOKEN_TTL", 7 * 24 * 3600))
+    kind = os.getenv("SESSION_STORE", "database")
+
+    if kind == "redis":
+        from redis_.redis__ import RedisSessionStore
+
+        return RedisSessionStore(
+            host=os.getenv("REDIS_HOST", "localhost"),
+            port=int(os.getenv("REDIS_PORT", 6379)),
+            ttl=ttl,
+        )
+
+    if kind == "memory":
+        return InMemorySessionStore(ttl)
+
+    from db.db import async_session
+
+    return DatabaseSessionStore(async_session, ttl)
+
+
+session_store = session_store_from_env()
@@ -0,0 +1,15 @@
+import os
+
+import pytest
+
+
+# The engine is built when db.db is imported but only connects on use, the
+# tests never reach a database. JWTs need a key.
+os.environ.setdefault("DATABASE_URL", "postgresql+asyncpg://test@localhost/test")
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ.setdefault("algorithm", "HS256")
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
@@ -0,0 +1,116 @@
+"""
+Cross-worker fan-out, with two ConnectionManagers sharing an InMemoryHub
+in place of two workers sharing Redis or Postgres.
+"""
+import asyncio
+
+import pytest
+
+from ws.backplane import InMemoryBackplane, InMemoryHub
+from ws.manager import ConnectionManager
+
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeWebSocket:
+    """The part of starlette's WebSocket the manager uses, recording sent frames."""
+
+    def __init__(self):
+        self.frames: list[str] = []
+        self.close_code: int | None = None
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message: str):
+        self.frames.append(message)
+
+    async def close(self, code: int = 1000):
+        self.close_code = code
+
+
+async def drain():
+    # Let the writer tasks of the connections send what was queued
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+@pytest.fixture
+async def workers():
+    hub = InMemoryHub()
+    managers = [ConnectionManager(backplane=InMemoryBackplane(hub)) for _ in range(2)]
+    for manager in managers:
+        await manager.start()
+    yield managers
+    for manager in managers:
+        await manager.stop()
+
+
+async def test_send_to_users_reaches_other_worker(workers):
+    first, second = workers
+    sender, receiver, bystander = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+    await first.connect(sender, 1)
+    await second.connect(receiver, 2)
+    await second.connect(bystander, 3)
+
+    await first.send_to_users([1, 2], "hello")
+    await drain()
+
+    assert sender.frames == ["hello"]
+    assert receiver.frames == ["hello"]
+    assert bystander.frames == []
+
+
+async def test_node_does_not_receive_own_publish(workers):
+    first, second = workers
+    local, remote = FakeWebSocket(), FakeWebSocket()
+    await first.connect(local, 1)
+    await second.connect(remote, 2)
+
+    envelopes = {first: [], second: []}
+    for manager in workers:
+        async def record(envelope, manager=manager):
+            envelopes[manager].append(envelope)
+            await manager._on_backplane(envelope)
+        manager.backplane._handler = record
+
+    await first.broadcast("everyone")
+    await drain()
+
+    assert envelopes[first] == []
+    assert [envelope["message"] for envelope in envelopes[second]] == ["everyone"]
+    # Delivered once on each worker
+    assert local.frames == ["everyone"]
+    assert remote.frames == ["everyone"]
+
+
+async def test_presence_released_with_last_socket(workers):
+    first, second = workers
+    tab, phone = FakeWebSocket(), FakeWebSocket()
+    await first.connect(tab, 1)
+    await first.connect(phone, 1)
+    assert await second.is_user_online(1)
+
+    await first.disconnect(tab)
+    assert await second.is_user_online(1)
+
+    await first.disconnect(phone)
+    assert not await second.is_user_online(1)
+    assert not await first.is_user_online(1)
+
+
+async def test_offline_presence_sent_once_with_last_socket(workers):
+    first, second = workers
+    tab, phone, watcher = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+    await second.connect(watcher, 2)
+    await first.connect(tab, 1)
+    await first.connect(phone, 1)
+
+    await first.disconnect(tab)
+    await drain()
+    assert watcher.frames == []
+
+    await first.disconnect(phone)
+    await drain()
+    assert watcher.frames == ['{"disconnected":true,"sender_id":1,"message":"1 is offline"}']
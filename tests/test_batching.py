@@ -0,0 +1,128 @@
+import asyncio
+import json
+
+import pytest
+from fastapi import WebSocketDisconnect
+
+import app as chat_app
+from security.security import create_access_token
+from ws.backplane import InMemoryBackplane, InMemoryHub
+from ws.connection import DROP_OLDEST, Connection
+from ws.frames import batch_frame
+from ws.manager import ConnectionManager
+
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeWebSocket:
+    """The part of starlette's WebSocket a Connection uses, recording sent frames."""
+
+    def __init__(self, query_params: dict | None = None):
+        self.query_params = query_params or {}
+        self.frames: list[str] = []
+        self.waiting = asyncio.Event()
+        self.closing = asyncio.Event()
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message: str):
+        self.frames.append(message)
+
+    async def receive_text(self) -> str:
+        self.waiting.set()
+        await self.closing.wait()
+        raise WebSocketDisconnect(1000)
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+async def evict(connection):
+    pass
+
+
+def connection(websocket, batch_max: int, batch_window: float = 0.01) -> Connection:
+    return Connection(websocket, 1, 100, DROP_OLDEST, evict, batch_max=batch_max, batch_window=batch_window)
+
+
+def test_batch_frame_joins_encoded_frames_and_quotes_text():
+    frame = batch_frame(['{"id":1}', '[2,3]', "401 Unauthorized"])
+
+    assert frame == '[{"id":1},[2,3],"401 Unauthorized"]'
+    assert json.loads(frame) == [{"id": 1}, [2, 3], "401 Unauthorized"]
+
+
+async def test_write_batch_sends_a_burst_in_frames_of_batch_max():
+    websocket = FakeWebSocket()
+    sender = connection(websocket, batch_max=3)
+
+    for n in range(5):
+        sender.enqueue(f'{{"n":{n}}}')
+    await asyncio.sleep(0.05)
+
+    assert [json.loads(frame) for frame in websocket.frames] == [
+        [{"n": 0}, {"n": 1}, {"n": 2}],
+        [{"n": 3}, {"n": 4}],
+    ]
+    assert sender.sent == 5
+    assert sender.batched == 5
+    await sender.close()
+
+
+async def test_write_batch_sends_a_lone_frame_as_is():
+    websocket = FakeWebSocket()
+    sender = connection(websocket, batch_max=3)
+
+    sender.enqueue('{"n":0}')
+    await asyncio.sleep(0.05)
+
+    assert websocket.frames == ['{"n":0}']
+    assert sender.batched == 0
+    await sender.close()
+
+
+async def test_unbatched_connection_sends_frame_per_message():
+    websocket = FakeWebSocket()
+    sender = connection(websocket, batch_max=1)
+
+    for n in range(3):
+        sender.enqueue(f'{{"n":{n}}}')
+    await asyncio.sleep(0.05)
+
+    assert websocket.frames == ['{"n":0}', '{"n":1}', '{"n":2}']
+    assert sender.batched == 0
+    await sender.close()
+
+
+async def test_manager_batches_only_when_asked():
+    manager = ConnectionManager()
+    manager.batch_max = 20
+    plain, batched = FakeWebSocket(), FakeWebSocket()
+
+    await manager.connect(plain, 1)
+    await manager.connect(batched, 2, batch=True)
+
+    assert manager.connections[plain].batch_max == 1
+    assert manager.connections[batched].batch_max == 20
+    await manager.stop()
+
+
+@pytest.mark.parametrize("query_params, batch_max", [({}, 1), ({"batch": "0"}, 1), ({"batch": "1"}, 20)])
+async def test_endpoint_negotiates_batches_through_query(monkeypatch, query_params, batch_max):
+    manager = ConnectionManager(backplane=InMemoryBackplane(InMemoryHub()))
+    manager.batch_max = 20
+    await manager.start()
+    monkeypatch.setattr(chat_app, "manager", manager)
+    websocket_endpoint = next(route.endpoint for route in chat_app.app.routes if route.path == "/ws/{sender_id}/{token}")
+    websocket = FakeWebSocket(query_params)
+
+    task = asyncio.create_task(websocket_endpoint(websocket, 1, await create_access_token({"id": 1})))
+    await websocket.waiting.wait()
+
+    assert manager.connections[websocket].batch_max == batch_max
+
+    websocket.closing.set()
+    await task
+    await manager.stop()
@@ -0,0 +1,44 @@
+import asyncio
+
+import pytest
+
+from ws.connection import DISCONNECT, SLOW_CONSUMER_CLOSE_CODE
+from ws.manager import ConnectionManager
+
+
+pytestmark = pytest.mark.anyio
+
+
+class StalledWebSocket:
+    """A client whose link stalled: every send waits forever."""
+
+    def __init__(self):
+        self.close_code: int | None = None
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message: str):
+        await asyncio.Event().wait()
+
+    async def close(self, code: int = 1000):
+        self.close_code = code
+
+
+async def test_disconnect_policy_evicts_without_waiting_for_send():
+    manager = ConnectionManager(max_queue=2, overflow_policy=DISCONNECT)
+    await manager.start()
+    websocket = StalledWebSocket()
+    await manager.connect(websocket, 1)
+
+    # The first frame is stuck in send_text, the next two fill the queue
+    for n in range(4):
+        manager._send_local([1], f"frame {n}")
+        await asyncio.sleep(0)
+    await asyncio.sleep(0)
+
+    assert websocket not in manager.connections
+    assert not await manager.is_user_online(1)
+    assert websocket.close_code == SLOW_CONSUMER_CLOSE_CODE
+    assert manager.evicted == 1
+    await manager.stop()
@@ -0,0 +1,138 @@
+"""
+The websocket endpoint against a stubbed async_session: a session is open
+only while a message is stored, never while the sockets wait for frames.
+"""
+import asyncio
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+from fastapi import WebSocketDisconnect
+
+import app as chat_app
+from security.security import create_access_token
+from ws.backplane import InMemoryBackplane, InMemoryHub
+from ws.manager import ConnectionManager
+
+
+pytestmark = pytest.mark.anyio
+
+
+class SessionFactory:
+    """Stands in for async_session, counting the sessions currently open."""
+
+    def __init__(self):
+        self.open = 0
+        self.opened = 0
+
+    def __call__(self):
+        return self
+
+    async def __aenter__(self):
+        self.open += 1
+        self.opened += 1
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.open -= 1
+
+
+class FakeOrm:
+    """OrmService, recording the open sessions each store ran in."""
+
+    messages: list[tuple[int, int, str]] = []
+
+    def __init__(self, db):
+        self.db = db
+        assert db.open == 1
+
+    async def send_message(self, sender_id, receiver_id, message, read, writer=None):
+        self.messages.append((sender_id, receiver_id, message))
+        return SimpleNamespace(id=len(self.messages), chat_id=1, created_at=datetime.now(timezone.utc))
+
+    async def chat_participants(self, chat_id):
+        return [1, 2]
+
+
+class ClientWebSocket:
+    """The server side of a client socket: frames to receive are fed in by the test."""
+
+    def __init__(self):
+        self.query_params = {}
+        self.incoming: asyncio.Queue[str | None] = asyncio.Queue()
+        self.frames: list[str] = []
+        self.waiting = asyncio.Event()
+
+    async def accept(self):
+        pass
+
+    async def receive_text(self) -> str:
+        self.waiting.set()
+        text = await self.incoming.get()
+        self.waiting.clear()
+        if text is None:
+            raise WebSocketDisconnect(1000)
+        return text
+
+    async def send_text(self, message: str):
+        self.frames.append(message)
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+def endpoint(path: str):
+    return next(route.endpoint for route in chat_app.app.routes if route.path == path)
+
+
+@pytest.fixture
+async def sessions(monkeypatch):
+    factory = SessionFactory()
+    manager = ConnectionManager(backplane=InMemoryBackplane(InMemoryHub()))
+    await manager.start()
+    FakeOrm.messages = []
+    monkeypatch.setattr(chat_app, "async_session", factory)
+    monkeypatch.setattr(chat_app, "OrmService", FakeOrm)
+    monkeypatch.setattr(chat_app, "manager", manager)
+    monkeypatch.setattr(chat_app, "message_writer", None)
+    yield factory
+    await manager.stop()
+
+
+async def idle(*sockets: ClientWebSocket):
+    for websocket in sockets:
+        await websocket.waiting.wait()
+
+
+async def test_idle_sockets_hold_no_session(sessions):
+    websocket_endpoint = endpoint("/ws/{sender_id}/{token}")
+    sender, receiver = ClientWebSocket(), ClientWebSocket()
+    tasks = [
+        asyncio.create_task(websocket_endpoint(sender, 1, await create_access_token({"id": 1}))),
+        asyncio.create_task(websocket_endpoint(receiver, 2, await create_access_token({"id": 2}))),
+    ]
+
+    await idle(sender, receiver)
+    assert sessions.opened == 0
+
+    for n in range(3):
+        sender.incoming.put_nowait(f'{{"sender_id": 1, "receiver_id": 2, "message": "hi {n}"}}')
+        await asyncio.sleep(0)
+        await idle(sender, receiver)
+        # Stored in a session of its own, closed before the socket waits again
+        assert sessions.open == 0
+
+    assert sessions.opened == 3
+    assert [message for _, _, message in FakeOrm.messages] == ["hi 0", "hi 1", "hi 2"]
+
+    sender.incoming.put_nowait(None)
+    receiver.incoming.put_nowait(None)
+    await asyncio.gather(*tasks)
+    assert sessions.open == 0
+
+
+async def test_send_chat_message_closes_its_session(sessions):
+    await chat_app.send_chat_message(1, 2, "hello")
+
+    assert sessions.opened == 1
+    assert sessions.open == 0
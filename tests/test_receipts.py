@@ -0,0 +1,44 @@
+import orjson
+import pytest
+
+from ws.manager import ConnectionManager
+from ws.receipts import ReadReceipts
+
+
+pytestmark = pytest.mark.anyio
+
+
+class RecordingManager(ConnectionManager):
+    def __init__(self):
+        super().__init__()
+        self.sent: list[tuple[list[int], dict, str | None]] = []
+
+    async def send_to_users(self, user_ids, message: str, key: str | None = None):
+        self.sent.append((list(user_ids), orjson.loads(message), key))
+
+
+async def test_receipts_of_one_reader_coalesce_to_highest_id():
+    manager = RecordingManager()
+    receipts = ReadReceipts(manager, delay=0.01)
+
+    for message_id in (10, 12, 11):
+        receipts.push(chat_id=1, reader_id=2, message_id=message_id, user_ids=[1, 2])
+    receipts.push(chat_id=1, reader_id=1, message_id=9, user_ids=[1, 2])
+    await receipts.stop()
+
+    assert sorted(manager.sent, key=lambda sent: sent[1]["user_id"]) == [
+        ([1, 2], {"info": "read", "chat_id": 1, "user_id": 1, "message_id": 9}, "read:1:1"),
+        ([1, 2], {"info": "read", "chat_id": 1, "user_id": 2, "message_id": 12}, "read:1:2"),
+    ]
+
+
+async def test_receipt_after_flush_is_sent_again():
+    manager = RecordingManager()
+    receipts = ReadReceipts(manager, delay=0.01)
+
+    receipts.push(chat_id=1, reader_id=2, message_id=5, user_ids=[1, 2])
+    await receipts.stop()
+    receipts.push(chat_id=1, reader_id=2, message_id=6, user_ids=[1, 2])
+    await receipts.stop()
+
+    assert [sent[1]["message_id"] for sent in manager.sent] == [5, 6]
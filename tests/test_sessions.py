@@ -0,0 +1,79 @@
+import pytest
+from fastapi import HTTPException
+
+import security.security as security
+from security.sessions import InMemorySessionStore
+
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = InMemorySessionStore(ttl=3600)
+    monkeypatch.setattr(security, "session_store", store)
+    return store
+
+
+async def test_rotated_session_cannot_be_reused(store):
+    session_id = await store.create(1)
+
+    user_id, new_session_id = await store.rotate(session_id)
+
+    assert user_id == 1
+    assert new_session_id != session_id
+    assert await store.rotate(session_id) is None
+    assert await store.get(session_id) is None
+    assert await store.get(new_session_id) == 1
+
+
+async def test_expired_session_is_rejected():
+    store = InMemorySessionStore(ttl=0)
+    session_id = await store.create(1)
+
+    assert await store.get(session_id) is None
+    assert await store.rotate(session_id) is None
+
+
+async def test_revoked_session_is_rejected(store):
+    session_id = await store.create(1)
+
+    await store.revoke(session_id)
+
+    assert await store.get(session_id) is None
+    assert await store.rotate(session_id) is None
+
+
+async def test_expired_sessions_are_dropped_on_create():
+    store = InMemorySessionStore(ttl=0)
+    for user_id in range(3):
+        await store.create(user_id)
+
+    # Each create drops the sessions expired before it
+    assert len(store.sessions) == 1
+
+
+async def test_refresh_token_works_once(store):
+    session_id = await store.create(7)
+    refresh_token = await security.create_refresh_token({"id": 7, "sid": session_id})
+
+    refreshed = await security.get_new_access_token(refresh_token)
+    assert refreshed.refresh_token != refresh_token
+
+    with pytest.raises(HTTPException) as reused:
+        await security.get_new_access_token(refresh_token)
+    assert reused.value.status_code == 401
+
+    # The rotated token still works, once
+    await security.get_new_access_token(refreshed.refresh_token)
+
+
+async def test_refresh_token_of_revoked_session_is_rejected(store):
+    session_id = await store.create(7)
+    refresh_token = await security.create_refresh_token({"id": 7, "sid": session_id})
+
+    await store.revoke(session_id)
+
+    with pytest.raises(HTTPException) as revoked:
+        await security.get_new_access_token(refresh_token)
+    assert revoked.value.status_code == 401
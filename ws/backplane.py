@@ -0,0 +1,279 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from collections import Counter
+from typing import Awaitable, Callable
+
+from dotenv import load_dotenv
+import orjson
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[dict], Awaitable[None]]
+
+
+class Backplane:
+    """
+    Carries fan-out envelopes and presence between workers.
+
+    Every worker (uvicorn process or container) owns one backplane. The
+    ConnectionManager delivers to its own sockets directly and publishes an
+    envelope so the other workers deliver to theirs. Envelopes published by
+    this node are never handed back to it.
+    """
+
+    def __init__(self):
+        self.node_id = uuid.uuid4().hex
+        self._handler: Handler | None = None
+
+    async def start(self, handler: Handler) -> None:
+        self._handler = handler
+
+    async def stop(self) -> None:
+        self._handler = None
+
+    async def publish(self, envelope: dict) -> None:
+        raise NotImplementedError
+
+    async def user_online(self, user_id: int) -> None:
+        """The first connection of user_id was opened on this node."""
+        raise NotImplementedError
+
+    async def user_offline(self, user_id: int) -> None:
+        """The last connection of user_id on this node was closed."""
+        raise NotImplementedError
+
+    async def is_online(self, user_id: int) -> bool:
+        raise NotImplementedError
+
+    def _encode(self, envelope: dict) -> str:
+        return orjson.dumps({**envelope, "node": self.node_id}).decode()
+
+    async def _dispatch(self, raw: str | bytes) -> None:
+        envelope = orjson.loads(raw)
+        if envelope.get("node") == self.node_id or self._handler is None:
+            return
+        await self._handler(envelope)
+
+
+class InMemoryHub:
+    """Process-local stand-in for Redis/Postgres shared by several InMemoryBackplanes."""
+
+    def __init__(self):
+        self.nodes: list["InMemoryBackplane"] = []
+        self.presence: Counter[int] = Counter()
+
+
+class InMemoryBackplane(Backplane):
+    """
+    Single-process backplane.
+
+    Used by default when running one worker. Several instances sharing an
+    InMemoryHub behave like workers sharing a Redis server, which lets the
+    cross-worker paths be exercised without any external service.
+    """
+
+    def __init__(self, hub: InMemoryHub | None = None):
+        super().__init__()
+        self.hub = hub or InMemoryHub()
+
+    async def start(self, handler: Handler) -> None:
+        await super().start(handler)
+        self.hub.nodes.append(self)
+
+    async def stop(self) -> None:
+        if self in self.hub.nodes:
+            self.hub.nodes.remove(self)
+        await super().stop()
+
+    async def publish(self, envelope: dict) -> None:
+        peers = [node for node in self.hub.nodes if node is not self]
+        # A single worker has no peers, the frame is not encoded a second time
+        if not peers:
+            return
+        raw = self._encode(envelope)
+        for node in peers:
+            await node._dispatch(raw)
+
+    async def user_online(self, user_id: int) -> None:
+        self.hub.presence[user_id] += 1
+
+    async def user_offline(self, user_id: int) -> None:
+        self.hub.presence[user_id] -= 1
+        if self.hub.presence[user_id] <= 0:
+            del self.hub.presence[user_id]
+
+    async def is_online(self, user_id: int) -> bool:
+        return self.hub.presence[user_id] > 0
+
+
+class PostgresBackplane(Backplane):
+    """
+    Backplane over Postgres LISTEN/NOTIFY.
+
+    Needs no extra infrastructure. NOTIFY payloads are limited to 8000
+    bytes, larger envelopes are stored in the fanout_payload table and only
+    their row id is notified. Presence is gossiped: each node announces its
+    users and answers a sync request sent by nodes that start later. Every
+    node also republishes its users as a heartbeat, and peers forget a node
+    not heard from within presence_ttl, so a crashed node does not keep its
+    users online.
+    """
+
+    channel = "chat_fanout"
+    # pg_notify rejects payloads of 8000 bytes and more
+    max_notify_bytes = 7999
+    # Seconds a stored envelope is kept for the peers to read it
+    payload_ttl = 60
+    # Seconds of silence after which a node's users stop counting as online
+    presence_ttl = 30
+
+    def __init__(self, dsn: str):
+        super().__init__()
+        # asyncpg does not understand the SQLAlchemy driver suffix
+        self.dsn = dsn.replace("+asyncpg", "")
+        self._listen_conn = None
+        self._notify_conn = None
+        self._notify_lock = asyncio.Lock()
+        self._local: set[int] = set()
+        self._remote: dict[str, set[int]] = {}
+        # node id -> when an envelope of it last arrived (monotonic)
+        self._seen: dict[str, float] = {}
+        self._heartbeat: asyncio.Task | None = None
+        # Notifications being dispatched, kept so they are not garbage collected
+        self._tasks: set[asyncio.Task] = set()
+
+    async def start(self, handler: Handler) -> None:
+        import asyncpg
+
+        await super().start(handler)
+        self._listen_conn = await asyncpg.connect(self.dsn)
+        self._notify_conn = await asyncpg.connect(self.dsn)
+        await self._listen_conn.add_listener(self.channel, self._on_notify)
+        await self.publish({"type": "presence_sync"})
+        self._heartbeat = asyncio.create_task(self._beat())
+
+    async def stop(self) -> None:
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+        if self._listen_conn is not None:
+            await self._listen_conn.remove_listener(self.channel, self._on_notify)
+            await self._listen_conn.close()
+        for task in list(self._tasks):
+            task.cancel()
+        if self._notify_conn is not None:
+            await self.publish({"type": "node_down"})
+            await self._notify_conn.close()
+        self._listen_conn = self._notify_conn = None
+        await super().stop()
+
+    def _on_notify(self, connection, pid, channel, payload):
+        task = asyncio.get_running_loop().create_task(self._dispatch(payload))
+        self._tasks.add(task)
+        task.add_done_callback(self._dispatched)
+
+    def _dispatched(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Backplane envelope failed", exc_info=task.exception())
+
+    async def _dispatch(self, raw: str | bytes) -> None:
+        envelope = orjson.loads(raw)
+        node = envelope.get("node")
+        if node == self.node_id:
+            return
+        self._seen[node] = time.monotonic()
+
+        if "ref" in envelope:
+            async with self._notify_lock:
+                raw = await self._notify_conn.fetchval(
+                    "SELECT payload FROM fanout_payload WHERE id = $1", envelope["ref"]
+                )
+            if raw is None:
+                logger.warning("Backplane envelope expired before it was read", extra={"ref": envelope["ref"]})
+                return
+            envelope = orjson.loads(raw)
+
+        kind = envelope.get("type")
+        if kind == "presence":
+            users = self._remote.setdefault(node, set())
+            if envelope["online"]:
+                users.add(envelope["user_id"])
+            else:
+                users.discard(envelope["user_id"])
+        elif kind == "presence_sync":
+            await self.publish({"type": "presence_state", "users": sorted(self._local)})
+        elif kind == "presence_state":
+            self._remote[node] = set(envelope["users"])
+        elif kind == "node_down":
+            self._remote.pop(node, None)
+            self._seen.pop(node, None)
+        elif self._handler is not None:
+            await self._handler(envelope)
+
+    async def publish(self, envelope: dict) -> None:
+        raw = self._encode(envelope)
+        async with self._notify_lock:
+            if len(raw.encode()) > self.max_notify_bytes:
+                # Peers load it by id, rows older than payload_ttl go on the way
+                await self._notify_conn.execute(
+                    "DELETE FROM fanout_payload WHERE created_at < now() - make_interval(secs => $1)",
+                    self.payload_ttl,
+                )
+                ref = await self._notify_conn.fetchval(
+                    "INSERT INTO fanout_payload (payload) VALUES ($1) RETURNING id", raw
+                )
+                raw = orjson.dumps({"node": self.node_id, "ref": ref}).decode()
+            await self._notify_conn.execute("SELECT pg_notify($1, $2)", self.channel, raw)
+
+    async def _beat(self):
+        while True:
+            await asyncio.sleep(self.presence_ttl / 3)
+            try:
+                await self.publish({"type": "presence_state", "users": sorted(self._local)})
+            except Exception:
+                logger.exception("Backplane heartbeat failed")
+
+    def _expire_nodes(self):
+        deadline = time.monotonic() - self.presence_ttl
+        for node in [node for node, seen in self._seen.items() if seen < deadline]:
+            del self._seen[node]
+            self._remote.pop(node, None)
+            logger.warning("Backplane node expired", extra={"node": node})
+
+    async def user_online(self, user_id: int) -> None:
+        self._local.add(user_id)
+        await self.publish({"type": "presence", "user_id": user_id, "online": True})
+
+    async def user_offline(self, user_id: int) -> None:
+        self._local.discard(user_id)
+        await self.publish({"type": "presence", "user_id": user_id, "online": False})
+
+    async def is_online(self, user_id: int) -> bool:
+        if user_id in self._local:
+            return True
+        self._expire_nodes()
+        return any(user_id in users for users in self._remote.values())
+
+
+def backplane_from_env() -> Backplane:
+    """Pick the backplane from BACKPLANE=memory|redis|postgres (memory by default)."""
+    kind = os.getenv("BACKPLANE", "memory")
+
+    if kind == "redis":
+        from redis_.redis__ import RedisBackplane
+
+        return RedisBackplane(
+            host=os.getenv("REDIS_HOST", "localhost"),
+            port=int(os.getenv("REDIS_PORT", 6379)),
+        )
+
+    if kind == "postgres":
+        return PostgresBackplane(os.getenv("DATABASE_URL"))
+
+    return InMemoryBackplane()
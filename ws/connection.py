@@ -0,0 +1,154 @@
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable
+
+from fastapi import WebSocket
+
+from ws.frames import batch_frame
+
+
+DROP_OLDEST = "drop_oldest"
+COALESCE = "coalesce"
+DISCONNECT = "disconnect"
+
+OVERFLOW_POLICIES = (DROP_OLDEST, COALESCE, DISCONNECT)
+
+# "Try again later", sent to consumers evicted for falling behind
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+
+class Connection:
+    """
+    One websocket with a bounded outbound queue drained by its own writer task.
+
+    Enqueueing never waits on the network, so a slow client only delays its
+    own frames. When the queue is full the overflow policy decides what gives:
+
+    - drop_oldest: the oldest queued frame is discarded
+    - coalesce: a queued frame with the same key (e.g. the presence of one
+      user) is replaced by the new one, otherwise the oldest is discarded
+    - disconnect: the socket is closed with 1013 and evicted
+
+    With batch_max above 1 (clients that negotiated batches), the writer
+    waits batch_window seconds after the first queued frame and sends up to
+    batch_max of them as one JSON array frame. A lone frame is sent as is.
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        user_id: int,
+        max_queue: int,
+        policy: str,
+        on_evict: Callable[["Connection"], Awaitable[None]],
+        batch_max: int = 1,
+        batch_window: float = 0.0,
+    ):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.max_queue = max_queue
+        self.policy = policy
+        self.on_evict = on_evict
+        self.batch_max = batch_max
+        self.batch_window = batch_window
+
+        self.queue: deque[tuple[str | None, str]] = deque()
+        self.closed = False
+        self.evicted = False
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.max_depth = 0
+        # Frames that went out inside a batch with others
+        self.batched = 0
+
+        self._ready = asyncio.Event()
+        self.writer = asyncio.create_task(self._write())
+        self._evicting: asyncio.Task | None = None
+
+    @property
+    def depth(self) -> int:
+        return len(self.queue)
+
+    def enqueue(self, message: str, key: str | None = None):
+        if self.closed:
+            return
+
+        if len(self.queue) >= self.max_queue:
+            if self.policy == DISCONNECT:
+                self._evict()
+                return
+
+            if self.policy == COALESCE and key is not None:
+                for index, (queued_key, _) in enumerate(self.queue):
+                    if queued_key == key:
+                        self.queue[index] = (key, message)
+                        self.coalesced += 1
+                        return
+
+            self.queue.popleft()
+            self.dropped += 1
+
+        self.queue.append((key, message))
+        self.max_depth = max(self.max_depth, len(self.queue))
+        self._ready.set()
+
+    async def _write(self):
+        try:
+            while not self.closed:
+                if not self.queue:
+                    self._ready.clear()
+                    await self._ready.wait()
+                    continue
+                if self.batch_max > 1:
+                    await self._write_batch()
+                    continue
+                _, message = self.queue.popleft()
+                await self.websocket.send_text(message)
+                self.sent += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # The socket went away, its receive loop will disconnect it
+            self.closed = True
+            self.queue.clear()
+
+    async def _write_batch(self):
+        if self.batch_window and len(self.queue) < self.batch_max:
+            # Let a burst gather, close() may empty the queue meanwhile
+            await asyncio.sleep(self.batch_window)
+        count = min(len(self.queue), self.batch_max)
+        if count == 0:
+            return
+        messages = [self.queue.popleft()[1] for _ in range(count)]
+        await self.websocket.send_text(messages[0] if count == 1 else batch_frame(messages))
+        self.sent += count
+        if count > 1:
+            self.batched += count
+
+    def _evict(self):
+        """
+        Drop the connection now, without waiting for the send in progress.
+
+        A consumer is usually slow because its link stalled, and that send
+        would only return at the keepalive timeout. The writer is cancelled,
+        the manager forgets the socket and the 1013 close goes out in a task.
+        """
+        self.evicted = True
+        self.closed = True
+        self.queue.clear()
+        self.writer.cancel()
+        self._evicting = asyncio.get_running_loop().create_task(self._close_evicted())
+
+    async def _close_evicted(self):
+        await self.on_evict(self)
+        try:
+            await self.websocket.close(code=SLOW_CONSUMER_CLOSE_CODE)
+        except Exception:
+            pass
+
+    async def close(self):
+        self.closed = True
+        self.queue.clear()
+        if self.writer is not asyncio.current_task():
+            self.writer.cancel()
@@ -0,0 +1,27 @@
+import orjson
+
+
+def encode_frame(data: dict) -> str:
+    """
+    A JSON text frame, encoded once per event with orjson.
+
+    The ConnectionManager queues the same str to every recipient socket.
+    It stays a str, not bytes, so clients keep getting text frames.
+    """
+    return orjson.dumps(data).decode()
+
+
+def decode_frame(raw: str | bytes) -> dict | list:
+    return orjson.loads(raw)
+
+
+def batch_frame(frames: list[str]) -> str:
+    """
+    Several queued frames as one JSON array, for clients that asked for batches.
+
+    The frames are already encoded and are joined as they are. The few
+    plain-text ones ("401 Unauthorized", ...) become JSON strings.
+    """
+    return "[" + ",".join(
+        frame if frame[:1] in ("{", "[") else orjson.dumps(frame).decode() for frame in frames
+    ) + "]"
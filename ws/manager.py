@@ -0,0 +1,161 @@
+import logging
+import os
+
+from fastapi import WebSocket
+
+from ws.backplane import Backplane, InMemoryBackplane, backplane_from_env
+from ws.connection import Connection, OVERFLOW_POLICIES
+from ws.frames import encode_frame
+
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionManager:
+    def __init__(
+        self,
+        backplane: Backplane | None = None,
+        max_queue: int | None = None,
+        overflow_policy: str | None = None,
+    ):
+        # One user can be connected from several tabs/devices at once
+        self.active_connections: dict[int, set[Connection]] = {}
+        self.connections: dict[WebSocket, Connection] = {}
+        self.backplane = backplane or InMemoryBackplane()
+        self.max_queue = max_queue or int(os.getenv("WS_QUEUE_SIZE", 256))
+        self.overflow_policy = overflow_policy or os.getenv("WS_OVERFLOW_POLICY", "drop_oldest")
+        # For sockets that negotiated batches: frames per batch and how long one gathers
+        self.batch_max = int(os.getenv("WS_BATCH_MAX", 50))
+        self.batch_window = float(os.getenv("WS_BATCH_WINDOW_MS", 5)) / 1000
+        self.evicted = 0
+        # Plain counters, exported by /metrics through queue_stats
+        self.received = 0
+        self.fanout_frames = 0
+        self.fanout_sockets = 0
+        # Frames written by sockets that are gone
+        self.delivered_closed = 0
+
+        if self.overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {self.overflow_policy!r}")
+
+    async def start(self):
+        await self.backplane.start(self._on_backplane)
+
+    async def stop(self):
+        for connection in list(self.connections.values()):
+            await connection.close()
+        await self.backplane.stop()
+
+    async def connect(self, websocket: WebSocket, user_id: int, batch: bool = False):
+        """Accept the socket; with batch, queued frames may go out several to a frame."""
+        await websocket.accept()
+        connection = Connection(
+            websocket, user_id, self.max_queue, self.overflow_policy, self._evict,
+            batch_max=self.batch_max if batch else 1,
+            batch_window=self.batch_window,
+        )
+        connections = self.active_connections.setdefault(user_id, set())
+        connections.add(connection)
+        self.connections[websocket] = connection
+        if len(connections) == 1:
+            await self.backplane.user_online(user_id)
+        logger.info("Websocket connected", extra={"user_id": user_id, "sockets": len(connections)})
+
+    async def disconnect(self, websocket: WebSocket):
+        """Forget the socket; with the user's last one, announce the user offline."""
+        connection = self.connections.pop(websocket, None)
+        if connection is None:
+            return
+        await connection.close()
+        self.delivered_closed += connection.sent
+        user_id = connection.user_id
+        connections = self.active_connections[user_id]
+        connections.discard(connection)
+        if not connections:
+            del self.active_connections[user_id]
+            await self.backplane.user_offline(user_id)
+            # Same key as the "is active" frame of connect, a slow consumer keeps the latest
+            message_data = {"disconnected": True, "sender_id": user_id, "message": f"{user_id} is offline"}
+            await self.broadcast(encode_frame(message_data), key=f"presence:{user_id}")
+
+    async def _evict(self, connection: Connection):
+        self.evicted += 1
+        await self.disconnect(connection.websocket)
+
+    async def is_user_online(self, user_id: int) -> bool:
+        if user_id in self.active_connections:
+            return True
+        return await self.backplane.is_online(user_id)
+
+    async def send_personal_message(self, message: str, websocket: WebSocket):
+        if message.startswith == 'chat_onopen':
+            await websocket.send_text(message)
+        if message.startswith == 'chat_onclose':
+            await websocket.send_text(message)
+        else:
+            try:
+                await websocket.send_text(message)
+            except RuntimeError:
+                logger.info("Websocket closed, cannot send message")
+
+    async def broadcast(self, message: str, key: str | None = None):
+        """
+        Send to every socket of every worker.
+
+        Frames sharing a key may be coalesced for slow consumers, only the
+        latest one is then delivered.
+        """
+        self._broadcast_local(message, key)
+        await self.backplane.publish({"type": "broadcast", "message": message, "key": key})
+
+    async def send_to_users(self, user_ids, message: str, key: str | None = None):
+        """Send only to the sockets of user_ids, on whichever worker they are connected."""
+        user_ids = list(user_ids)
+        self._send_local(user_ids, message, key)
+        await self.backplane.publish({"type": "users", "users": user_ids, "message": message, "key": key})
+
+    def _send_local(self, user_ids, message: str, key: str | None = None):
+        sockets = 0
+        for user_id in user_ids:
+            for connection in self.active_connections.get(user_id, ()):
+                connection.enqueue(message, key)
+                sockets += 1
+        self.fanout_frames += 1
+        self.fanout_sockets += sockets
+
+    def _broadcast_local(self, message: str, key: str | None = None):
+        for connection in self.connections.values():
+            connection.enqueue(message, key)
+        self.fanout_frames += 1
+        self.fanout_sockets += len(self.connections)
+
+    async def _on_backplane(self, envelope: dict):
+        if envelope["type"] == "broadcast":
+            self._broadcast_local(envelope["message"], envelope.get("key"))
+        elif envelope["type"] == "users":
+            self._send_local(envelope["users"], envelope["message"], envelope.get("key"))
+
+    def get_connections(self, user_id: int) -> set[Connection]:
+        return self.active_connections.get(user_id, set())
+
+    def queue_stats(self) -> dict:
+        """Sockets, outbound queue depth, overflow and delivery counters of this worker."""
+        connections = list(self.connections.values())
+        depths = [connection.depth for connection in connections]
+        return {
+            "connections": len(connections),
+            "queued": sum(depths),
+            "max_depth": max(depths, default=0),
+            "dropped": sum(connection.dropped for connection in connections),
+            "coalesced": sum(connection.coalesced for connection in connections),
+            "batched": sum(connection.batched for connection in connections),
+            "evicted": self.evicted,
+            "received": self.received,
+            "delivered": self.delivered_closed + sum(connection.sent for connection in connections),
+            # Average fan-out is the rate of sockets over the rate of frames
+            "fanout_frames": self.fanout_frames,
+            "fanout_sockets": self.fanout_sockets,
+        }
+
+
+manager = ConnectionManager(backplane=backplane_from_env())
@@ -0,0 +1,54 @@
+import asyncio
+
+from ws.frames import encode_frame
+from ws.manager import ConnectionManager, manager
+
+
+class ReadReceipts:
+    """
+    Coalesced "read up to id X" pushes.
+
+    Scrolling through a chat marks it read many times in a row. Receipts for
+    the same (chat, reader) are held for delay seconds and only the highest
+    message id is pushed to the other participants.
+    """
+
+    def __init__(self, manager: ConnectionManager, delay: float = 0.2):
+        self.manager = manager
+        self.delay = delay
+        # (chat_id, reader_id) -> (highest message id, participants to notify)
+        self.pending: dict[tuple[int, int], tuple[int, list[int]]] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    def push(self, chat_id: int, reader_id: int, message_id: int, user_ids: list[int]):
+        key = (chat_id, reader_id)
+        if key in self.pending:
+            pending_id, _ = self.pending[key]
+            self.pending[key] = (max(pending_id, message_id), user_ids)
+            return
+
+        self.pending[key] = (message_id, user_ids)
+        task = asyncio.create_task(self._flush(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush(self, key: tuple[int, int]):
+        await asyncio.sleep(self.delay)
+        message_id, user_ids = self.pending.pop(key)
+        chat_id, reader_id = key
+        message_data = {
+            "info": "read",
+            "chat_id": chat_id,
+            "user_id": reader_id,
+            "message_id": message_id,
+        }
+        await self.manager.send_to_users(
+            user_ids, encode_frame(message_data), key=f"read:{chat_id}:{reader_id}"
+        )
+
+    async def stop(self):
+        """Deliver the receipts still waiting."""
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+receipts = ReadReceipts(manager)